@@ -1,9 +1,15 @@
 """Core logic for the Meltingplot Config plugin: sync, diff, apply, hunks."""
 
 import difflib
+import functools
+import hashlib
 import logging
 import os
-import re
+import stat
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
 from git_utils import (
@@ -13,6 +19,7 @@ from git_utils import (
     backup_commit,
     backup_delete,
     backup_file_content,
+    backup_file_contents,
     backup_files_at,
     backup_log,
     checkout,
@@ -24,6 +31,7 @@ from git_utils import (
     list_files,
     list_remote_branches,
     pull,
+    TEMP_FILE_PREFIX,
 )
 
 logger = logging.getLogger("MeltingplotConfig")
@@ -36,6 +44,22 @@ DATA_DIR = "/opt/dsf/sd/MeltingplotConfig"
 REFERENCE_DIR = os.path.join(DATA_DIR, "reference")
 BACKUP_DIR = os.path.join(DATA_DIR, "backups")
 
+# diff_all compares files on a thread pool once there are enough of them
+# for the pool's startup cost to pay off.
+FILE_POOL_WORKERS = 8
+FILE_POOL_MIN_FILES = 4
+
+# Reference texts memoized by _read_text_cached: about the size of a
+# managed config tree.  Larger files are read on every call instead of
+# being pinned in memory.
+REFERENCE_CACHE_SIZE = 64
+REFERENCE_CACHE_MAX_FILE_SIZE = 256 * 1024
+
+# Printer files larger than this are not read into memory; config files
+# are a few KiB, so anything this big is not a config file.  They are
+# reported as "too_large" rather than diffed.
+MAX_PRINTER_FILE_SIZE = 16 * 1024 * 1024
+
 # Directories backed up via the worktree-based backup repo.
 # Only these top-level printer directories are tracked; everything else
 # (gcodes, firmware, www, menu) is excluded by not being staged.
@@ -49,6 +73,7 @@ PROTECTED_FILES = (
     "sys/meltingplot/machine-override",
     "sys/meltingplot/dsf-config-override.g",
 )
+_PROTECTED_FILES_SET = frozenset(PROTECTED_FILES)
 
 # Default directory mapping (fallback when DSF object model is unavailable).
 # In production, the daemon reads model.directories and builds this dynamically.
@@ -63,6 +88,18 @@ DEFAULT_DIRECTORY_MAP = {
 }
 
 
+class PrinterFileTooLarge(Exception):
+    """A printer file exceeds ``MAX_PRINTER_FILE_SIZE`` and was not read."""
+
+    def __init__(self, printer_path, size):
+        super().__init__(
+            f"Printer file too large: {printer_path} "
+            f"({size} bytes, limit {MAX_PRINTER_FILE_SIZE})"
+        )
+        self.printer_path = printer_path
+        self.size = size
+
+
 class ConfigManager:
     """Manages reference sync, diffing, applying, and backups."""
 
@@ -81,12 +118,43 @@ class ConfigManager:
         self._dsf = dsf_command_connection
         self._dir_map = directory_map if directory_map is not None else DEFAULT_DIRECTORY_MAP
         self._resolved_dirs = resolved_dirs if resolved_dirs is not None else self.DEFAULT_RESOLVED_DIRS
+        # REFERENCE_DIR last seen with a .git directory (see _reference_cloned).
+        self._cloned_reference_dir = None
+        # (REFERENCE_DIR, files) from the last ls-files; reset by sync().
+        self._reference_files_cache = None
+        # (REFERENCE_DIR, branch) — the checkout only moves in sync().
+        self._active_branch_cache = None
         # Derive the git worktree root and the relative directory names that
         # should be tracked in backups, using the resolved filesystem paths
         # from the DSF object model.
         self._worktree, self._backup_paths = self._compute_backup_worktree()
         init_backup_repo(BACKUP_DIR, worktree=self._worktree)
 
+    @property
+    def _dir_map(self):
+        return self._dir_map_dict
+
+    @_dir_map.setter
+    def _dir_map(self, mapping):
+        self._dir_map_dict = mapping
+        # Longest prefix first so a nested mapping (e.g. "sys/sub/") wins
+        # over its parent when both are present.
+        self._dir_map_sorted = tuple(
+            sorted(mapping.items(), key=lambda item: -len(item[0]))
+        )
+
+    @property
+    def _resolved_dirs(self):
+        return self._resolved_dirs_dict
+
+    @_resolved_dirs.setter
+    def _resolved_dirs(self, mapping):
+        self._resolved_dirs_dict = mapping
+        # Same ordering as _dir_map_sorted, scanned on every file access.
+        self._resolved_dirs_sorted = tuple(
+            sorted(mapping.items(), key=lambda item: -len(item[0]))
+        )
+
     def _compute_backup_worktree(self):
         """Derive the git worktree root and relative backup paths.
 
@@ -125,40 +193,102 @@ class ConfigManager:
         Uses resolved_dirs (populated at startup via DSF resolve_path)
         to map e.g. '0:/sys/config.g' -> '/opt/dsf/sd/sys/config.g'.
         """
-        for printer_prefix, fs_prefix in self._resolved_dirs.items():
+        for printer_prefix, fs_prefix in self._resolved_dirs_sorted:
             if printer_path.startswith(printer_prefix):
                 return fs_prefix + printer_path[len(printer_prefix):]
         return None
 
-    def _read_printer_file(self, printer_path):
-        """Read a file from the printer filesystem."""
+    def _read_printer_bytes(self, printer_path):
+        """Read a file from the printer filesystem as raw bytes.
+
+        Returns None if the path cannot be resolved or the file cannot be
+        read.  Raises :class:`PrinterFileTooLarge` if it is larger than
+        ``MAX_PRINTER_FILE_SIZE``, so callers do not mistake it for a
+        missing file.
+        """
         fs_path = self._printer_to_fs_path(printer_path)
         if fs_path is None:
             logger.debug("Cannot resolve printer path: %s", printer_path)
             return None
         try:
-            with open(fs_path, "r", encoding="utf-8", errors="replace") as f:
-                return f.read()
-        except (FileNotFoundError, IOError) as exc:
+            with open(fs_path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size <= MAX_PRINTER_FILE_SIZE:
+                    return f.read()
+        except OSError as exc:
             logger.debug("Cannot read %s (%s): %s", printer_path, fs_path, exc)
             return None
+        raise PrinterFileTooLarge(printer_path, size)
+
+    def _read_printer_file(self, printer_path):
+        """Read a file from the printer filesystem as text."""
+        data = self._read_printer_bytes(printer_path)
+        if data is None:
+            return None
+        text = data.decode("utf-8", errors="replace")
+        # Match text-mode universal newlines so CRLF files compare equal.
+        if "\r" in text:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        return text
 
     def _write_printer_file(self, printer_path, content):
-        """Write a file to the printer filesystem."""
+        """Write a text file to the printer filesystem."""
+        self._write_printer_bytes(printer_path, content.encode("utf-8"))
+
+    def _write_printer_bytes(self, printer_path, data, fsync=True):
+        """Atomically write a file to the printer filesystem.
+
+        The data goes to a temporary file in the same directory, which then
+        replaces the target, so an interrupted write never leaves a
+        truncated config file behind.  With *fsync* (the default) the data
+        and the rename are flushed to disk before returning, so a power
+        loss right after an apply cannot leave an empty file either.
+
+        A symlinked target is resolved first: the file it points to is
+        replaced and the link itself is kept.
+        """
         fs_path = self._printer_to_fs_path(printer_path)
         if fs_path is None:
             raise RuntimeError(f"Cannot resolve printer path: {printer_path}")
-        os.makedirs(os.path.dirname(fs_path), exist_ok=True)
-        with open(fs_path, "w", encoding="utf-8") as f:
-            f.write(content)
+        fs_path = os.path.realpath(fs_path)
+        directory = os.path.dirname(fs_path)
+        os.makedirs(directory, exist_ok=True)
+        try:
+            mode = stat.S_IMODE(os.stat(fs_path).st_mode)
+        except FileNotFoundError:
+            mode = 0o644
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=TEMP_FILE_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                if fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            # mkstemp creates the file as 0600; keep the target's mode.
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, fs_path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        if fsync:
+            _fsync_dir(directory)
 
     def _read_reference_file(self, rel_path):
         """Read a file from the local reference repository."""
         full_path = os.path.join(REFERENCE_DIR, rel_path)
-        if not os.path.isfile(full_path):
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
             return None
-        with open(full_path, "r", encoding="utf-8", errors="replace") as f:
-            return f.read()
+        if st.st_size > REFERENCE_CACHE_MAX_FILE_SIZE:
+            return _read_text(full_path)
+        # Any checkout/pull that rewrites the file changes mtime or size.
+        return _read_text_cached(full_path, st.st_mtime_ns, st.st_size)
 
     def _ref_to_printer_path(self, ref_path):
         """Convert a reference repo path to a printer path.
@@ -168,7 +298,7 @@ class ConfigManager:
         The mapping is built from the DSF object model's directories
         property at startup, or falls back to DEFAULT_DIRECTORY_MAP.
         """
-        for ref_prefix, printer_prefix in self._dir_map.items():
+        for ref_prefix, printer_prefix in self._dir_map_sorted:
             if ref_path.startswith(ref_prefix):
                 return printer_prefix + ref_path[len(ref_prefix):]
         return None
@@ -206,6 +336,7 @@ class ConfigManager:
             }
 
         checkout(REFERENCE_DIR, branch)
+        self._active_branch_cache = (REFERENCE_DIR, branch)
         try:
             pull(REFERENCE_DIR)
         except RuntimeError as exc:
@@ -213,6 +344,10 @@ class ConfigManager:
             user_msg = _friendly_network_error(msg)
             logger.warning("Pull failed (network): %s", msg)
             return {"error": user_msg, "networkError": True}
+        finally:
+            _read_text_cached.cache_clear()
+            _clear_diff_cache()
+            self._reference_files_cache = None
 
         warning = None
         if not exact:
@@ -228,80 +363,120 @@ class ConfigManager:
             "branches": list_remote_branches(REFERENCE_DIR),
         }
 
+    def _reference_cloned(self):
+        """Return True if the reference repository has been cloned.
+
+        Only a positive result is remembered: once cloned, the checkout
+        is never removed by the plugin, so later calls skip the stat.
+        """
+        if self._cloned_reference_dir == REFERENCE_DIR:
+            return True
+        if not os.path.isdir(os.path.join(REFERENCE_DIR, ".git")):
+            return False
+        self._cloned_reference_dir = REFERENCE_DIR
+        return True
+
+    def _reference_files(self):
+        """List the tracked reference files, reusing the last listing.
+
+        The checkout only changes in :meth:`sync`, which drops the cached
+        listing, so repeated diff/apply calls skip ``git ls-files``.
+        """
+        cached = self._reference_files_cache
+        if cached is not None and cached[0] == REFERENCE_DIR:
+            return cached[1]
+        files = tuple(list_files(REFERENCE_DIR))
+        self._reference_files_cache = (REFERENCE_DIR, files)
+        return files
+
+    def get_reference_files(self):
+        """List the reference files the plugin manages.
+
+        Returns an empty list before the first clone; protected files are
+        left out.
+        """
+        if not self._reference_cloned():
+            return []
+        return [f for f in self._reference_files() if not is_protected(f)]
+
     def get_branches(self):
         """List available remote branches."""
-        if not os.path.isdir(os.path.join(REFERENCE_DIR, ".git")):
+        if not self._reference_cloned():
             return []
         return list_remote_branches(REFERENCE_DIR)
 
     def get_active_branch(self):
         """Get the currently checked-out branch."""
-        if not os.path.isdir(os.path.join(REFERENCE_DIR, ".git")):
+        if not self._reference_cloned():
             return ""
-        return current_branch(REFERENCE_DIR)
+        cached = self._active_branch_cache
+        if cached is not None and cached[0] == REFERENCE_DIR:
+            return cached[1]
+        branch = current_branch(REFERENCE_DIR)
+        self._active_branch_cache = (REFERENCE_DIR, branch)
+        return branch
 
     # --- Diffing ---
 
     def diff_all(self):
         """Compare all reference files against current printer files.
 
-        Returns a list of file diffs.
+        Returns a list of file diffs, in ``git ls-files`` order.  Files are
+        compared on a small thread pool so their reads overlap; the GIL
+        is released during file I/O.
         """
-        if not os.path.isdir(os.path.join(REFERENCE_DIR, ".git")):
-            return []
+        ref_files = self.get_reference_files()
+        return [d for d in _map_files(self._diff_one, ref_files) if d is not None]
 
-        ref_files = list_files(REFERENCE_DIR)
-        results = []
+    def _diff_one(self, ref_path):
+        """Build the ``diff_all`` summary entry for one reference file.
 
-        for ref_path in ref_files:
-            printer_path = self._ref_to_printer_path(ref_path)
-            if printer_path is None:
-                continue
+        Returns ``None`` for paths outside the directory mapping.
+        """
+        printer_path = self._ref_to_printer_path(ref_path)
+        if printer_path is None:
+            return None
 
-            if is_protected(ref_path):
-                continue
+        # Byte-identical files are unchanged; skip decoding and diffing.
+        fs_path = self._printer_to_fs_path(printer_path)
+        if fs_path is not None and _same_bytes(
+            os.path.join(REFERENCE_DIR, ref_path), fs_path
+        ):
+            return {
+                "file": ref_path,
+                "printerPath": printer_path,
+                "status": "unchanged",
+                "hunks": [],
+            }
 
-            ref_content = self._read_reference_file(ref_path)
+        ref_content = self._read_reference_file(ref_path)
+        try:
             printer_content = self._read_printer_file(printer_path)
+        except PrinterFileTooLarge:
+            return {
+                "file": ref_path,
+                "printerPath": printer_path,
+                "status": "too_large",
+                "hunks": [],
+            }
 
-            if printer_content is None:
-                # New file: compute summary hunks so the frontend shows a count
-                hunks = self._compute_hunks(ref_path, "", ref_content)
-                results.append(
-                    {
-                        "file": ref_path,
-                        "printerPath": printer_path,
-                        "status": "missing",
-                        "hunks": [
-                            {"index": h["index"], "header": h["header"]}
-                            for h in hunks
-                        ],
-                    }
-                )
-            elif ref_content == printer_content:
-                results.append(
-                    {
-                        "file": ref_path,
-                        "printerPath": printer_path,
-                        "status": "unchanged",
-                        "hunks": [],
-                    }
-                )
-            else:
-                hunks = self._compute_hunks(ref_path, printer_content, ref_content)
-                results.append(
-                    {
-                        "file": ref_path,
-                        "printerPath": printer_path,
-                        "status": "modified",
-                        "hunks": [
-                            {"index": h["index"], "header": h["header"]}
-                            for h in hunks
-                        ],
-                    }
-                )
-
-        return results
+        if printer_content is None:
+            # New file: compute summary hunks so the frontend shows a count
+            hunks = self._compute_hunks("", ref_content)
+            status = "missing"
+        elif ref_content == printer_content:
+            hunks = []
+            status = "unchanged"
+        else:
+            hunks = self._compute_hunks(printer_content, ref_content)
+            status = "modified"
+
+        return {
+            "file": ref_path,
+            "printerPath": printer_path,
+            "status": status,
+            "hunks": [{"index": h["index"], "header": h["header"]} for h in hunks],
+        }
 
     def diff_file(self, ref_path):
         """Get detailed diff for a single file, with indexed hunks.
@@ -316,25 +491,27 @@ class ConfigManager:
             return {"error": f"Protected file: {ref_path}"}
 
         ref_content = self._read_reference_file(ref_path)
-        printer_content = self._read_printer_file(printer_path)
+        try:
+            printer_content = self._read_printer_file(printer_path)
+        except PrinterFileTooLarge:
+            return {
+                "file": ref_path,
+                "status": "too_large",
+                "hunks": [],
+                "unifiedDiff": "",
+            }
 
         if ref_content is None:
             return {"file": ref_path, "status": "not_in_reference"}
 
         if printer_content is None:
             # New file: show the entire reference content as additions
-            hunks = self._compute_hunks(ref_path, "", ref_content)
-            unified = difflib.unified_diff(
-                [],
-                ref_content.splitlines(keepends=True),
-                fromfile=f"a/{ref_path}",
-                tofile=f"b/{ref_path}",
-            )
+            hunks = self._compute_hunks("", ref_content)
             return {
                 "file": ref_path,
                 "status": "missing",
                 "hunks": hunks,
-                "unifiedDiff": "".join(unified),
+                "unifiedDiff": _unified_diff_text(ref_path, "", ref_content),
             }
 
         if ref_content == printer_content:
@@ -345,72 +522,49 @@ class ConfigManager:
                 "unifiedDiff": "",
             }
 
-        hunks = self._compute_hunks(ref_path, printer_content, ref_content)
-        unified = difflib.unified_diff(
-            printer_content.splitlines(keepends=True),
-            ref_content.splitlines(keepends=True),
-            fromfile=f"a/{ref_path}",
-            tofile=f"b/{ref_path}",
-        )
+        hunks = self._compute_hunks(printer_content, ref_content)
+        unified = _unified_diff_text(ref_path, printer_content, ref_content)
 
         return {
             "file": ref_path,
             "status": "modified",
             "hunks": hunks,
-            "unifiedDiff": "".join(unified),
+            "unifiedDiff": unified,
         }
 
     @staticmethod
-    def _compute_hunks(ref_path, current_content, reference_content):
-        """Parse a unified diff into indexed hunks with summaries."""
-        diff_lines = list(
-            difflib.unified_diff(
-                current_content.splitlines(keepends=True),
-                reference_content.splitlines(keepends=True),
-                fromfile=f"a/{ref_path}",
-                tofile=f"b/{ref_path}",
-                n=3,
-            )
-        )
+    def _compute_hunks(current_content, reference_content):
+        """Parse a unified diff into indexed hunks with summaries.
 
-        hunks = []
-        current_hunk = None
-        hunk_index = 0
-
-        for line in diff_lines:
-            if line.startswith("@@"):
-                if current_hunk is not None:
-                    current_hunk["summary"] = _hunk_summary(current_hunk)
-                    hunks.append(current_hunk)
-                current_hunk = {
-                    "index": hunk_index,
-                    "header": line.rstrip("\n"),
-                    "lines": [],
-                    "summary": "",
-                }
-                hunk_index += 1
-            elif current_hunk is not None:
-                current_hunk["lines"].append(line.rstrip("\n"))
-
-        if current_hunk is not None:
-            current_hunk["summary"] = _hunk_summary(current_hunk)
-            hunks.append(current_hunk)
-
-        return hunks
+        The diff itself is memoized by :func:`_diff_groups`; fresh dicts are
+        built on every call so callers may mutate the result.
+        """
+        return [
+            {
+                "index": index,
+                "header": header,
+                "lines": list(lines),
+                "summary": summary,
+            }
+            for index, header, lines, summary in _diff_hunks(
+                current_content, reference_content
+            )
+        ]
 
     # --- Applying ---
 
     def apply_all(self):
         """Apply all reference config files to the printer (with backup)."""
-        if not os.path.isdir(os.path.join(REFERENCE_DIR, ".git")):
+        if not self._reference_cloned():
             return {"error": "Reference repository not cloned"}
 
         self._create_backup("Pre-update backup")
-        ref_files = list_files(REFERENCE_DIR)
         applied = []
         skipped = []
 
-        for ref_path in ref_files:
+        # Sequential on purpose: a failed write stops the run before any
+        # further printer files are overwritten.
+        for ref_path in self._reference_files():
             printer_path = self._ref_to_printer_path(ref_path)
             if printer_path is None:
                 continue
@@ -460,33 +614,27 @@ class ConfigManager:
             return {"error": f"Unknown reference path: {ref_path}"}
 
         ref_content = self._read_reference_file(ref_path)
-        printer_content = self._read_printer_file(printer_path)
         if ref_content is None:
             return {"error": f"Reference file not found: {ref_path}"}
+        try:
+            printer_content = self._read_printer_file(printer_path)
+        except PrinterFileTooLarge as exc:
+            return {"error": str(exc)}
         if printer_content is None:
             return {"error": f"Printer file not found: {printer_path}"}
 
-        hunks = self._compute_hunks(ref_path, printer_content, ref_content)
+        hunks = self._compute_hunks(printer_content, ref_content)
         selected = [h for h in hunks if h["index"] in hunk_indices]
         if not selected:
             return {"error": "No valid hunks selected", "applied": [], "failed": []}
 
         self._create_backup(f"Pre-update backup for {ref_path} (partial)")
 
-        result_lines = printer_content.splitlines(keepends=True)
-        applied = []
-        failed = []
-        offset = 0
-
-        for hunk in selected:
-            success, result_lines, new_offset = _apply_single_hunk(
-                result_lines, hunk, offset
-            )
-            if success:
-                applied.append(hunk["index"])
-                offset = new_offset
-            else:
-                failed.append(hunk["index"])
+        result_lines, results = _apply_hunks(
+            printer_content.splitlines(keepends=True), selected
+        )
+        applied = [h["index"] for h, ok in zip(selected, results) if ok]
+        failed = [h["index"] for h, ok in zip(selected, results) if not ok]
 
         new_content = "".join(result_lines)
         self._write_printer_file(printer_path, new_content)
@@ -577,38 +725,31 @@ class ConfigManager:
         Returns a dict with ``file``, ``status``, and ``hunks`` (full
         detail hunks with lines and summary).
         """
-        new_content = None
-        old_content = None
-
-        try:
-            new_content = backup_file_content(BACKUP_DIR, commit_hash, file_path)
-        except RuntimeError:
-            pass
-
         try:
-            old_content = backup_file_content(
-                BACKUP_DIR, f"{commit_hash}^", file_path
+            new_content, old_content = backup_file_contents(
+                BACKUP_DIR,
+                [(commit_hash, file_path), (f"{commit_hash}^", file_path)],
             )
         except RuntimeError:
-            pass
+            new_content = old_content = None
 
         if new_content is None and old_content is None:
             return {"file": file_path, "status": "unknown", "hunks": []}
 
         if old_content is None:
             # File was added in this commit
-            hunks = self._compute_hunks(file_path, "", new_content)
+            hunks = self._compute_hunks("", new_content)
             return {"file": file_path, "status": "added", "hunks": hunks}
 
         if new_content is None:
             # File was deleted in this commit
-            hunks = self._compute_hunks(file_path, old_content, "")
+            hunks = self._compute_hunks(old_content, "")
             return {"file": file_path, "status": "deleted", "hunks": hunks}
 
         if old_content == new_content:
             return {"file": file_path, "status": "unchanged", "hunks": []}
 
-        hunks = self._compute_hunks(file_path, old_content, new_content)
+        hunks = self._compute_hunks(old_content, new_content)
         return {"file": file_path, "status": "modified", "hunks": hunks}
 
     def get_backup_download(self, commit_hash):
@@ -643,79 +784,346 @@ def is_protected(ref_path):
     Protected files contain machine-specific calibration or user
     overrides that must never be replaced by reference config updates.
     """
-    return ref_path in PROTECTED_FILES
+    return ref_path in _PROTECTED_FILES_SET
+
+
+def _fsync_dir(path):
+    """Flush a directory entry change (e.g. a rename) to disk."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _map_files(func, items):
+    """Map *func* over *items* in order, on a thread pool for larger batches.
+
+    The first exception raised by *func* propagates to the caller.
+    """
+    if len(items) < FILE_POOL_MIN_FILES:
+        return list(map(func, items))
+    with ThreadPoolExecutor(max_workers=FILE_POOL_WORKERS) as pool:
+        return list(pool.map(func, items))
+
+
+def _read_text(full_path):
+    """Read a reference file as text."""
+    with open(full_path, "r", encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+@functools.lru_cache(maxsize=REFERENCE_CACHE_SIZE)
+def _read_text_cached(full_path, mtime_ns, size):
+    """Memoized :func:`_read_text`, keyed on the file's stat signature.
+
+    *mtime_ns* and *size* are only part of the cache key, so a rewritten
+    file gets a fresh entry.
+    """
+    return _read_text(full_path)
+
+
+def _same_bytes(path_a, path_b, chunk_size=65536):
+    """Return True if two files have identical bytes.
+
+    Sizes are compared first, then the contents in chunks, stopping at
+    the first difference.  Any OS error (missing file, permissions)
+    returns False so the caller falls back to its normal path.
+    """
+    try:
+        if os.path.getsize(path_a) != os.path.getsize(path_b):
+            return False
+        with open(path_a, "rb") as fa, open(path_b, "rb") as fb:
+            while True:
+                chunk = fa.read(chunk_size)
+                if chunk != fb.read(chunk_size):
+                    return False
+                if not chunk:
+                    return True
+    except OSError:
+        return False
 
 
 # --- Hunk patching helpers ---
 
-_HUNK_HEADER_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+# Diffs memoized by _diff_groups.  Keys are content digests, so the cache
+# never keeps whole file bodies alive; only the last few diffs are kept.
+DIFF_CACHE_SIZE = 32
+_diff_cache = OrderedDict()
+_diff_cache_lock = threading.Lock()
+
+
+def _content_digest(text):
+    """Return a short digest identifying *text* for the diff cache."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def _diff_groups(current_content, reference_content):
+    """Memoized :func:`_grouped_diff`, as a tuple of immutable hunks.
+
+    The same printer/reference pair is diffed repeatedly (``/diff``
+    listing, single-file detail, then ``applyHunks``), and the detail view
+    needs both the hunks and the unified text; all of them are derived
+    from this one diff.
+    """
+    key = (_content_digest(current_content), _content_digest(reference_content))
+    with _diff_cache_lock:
+        groups = _diff_cache.get(key)
+        if groups is not None:
+            _diff_cache.move_to_end(key)
+            return groups
+
+    groups = tuple(
+        (old_start, old_count, header, tuple(lines))
+        for old_start, old_count, header, lines in _grouped_diff(
+            current_content, reference_content
+        )
+    )
+    with _diff_cache_lock:
+        _diff_cache[key] = groups
+        if len(_diff_cache) > DIFF_CACHE_SIZE:
+            _diff_cache.popitem(last=False)
+    return groups
+
+
+def _clear_diff_cache():
+    """Drop all memoized diffs."""
+    with _diff_cache_lock:
+        _diff_cache.clear()
+
+
+def _diff_hunks(current_content, reference_content):
+    """Diff two file contents into ``(index, header, lines, summary)`` tuples."""
+    hunks = []
+    for index, (old_start, old_count, header, raw_lines) in enumerate(
+        _diff_groups(current_content, reference_content)
+    ):
+        lines = [line.rstrip("\n") for line in raw_lines]
+        # Summary comes from the numbers we already have; no need to
+        # parse the header string back.
+        hunks.append(
+            (index, header, tuple(lines), _summary_text(old_start, old_count))
+        )
+
+    return tuple(hunks)
+
+
+def _unified_diff_text(ref_path, current_content, reference_content):
+    """Render the same text as ``"".join(difflib.unified_diff(...))``.
+
+    Built from the memoized :func:`_diff_groups`, so rendering the text
+    next to the hunks does not diff the files a second time.  This holds
+    for repeated lines too, because :func:`_grouped_diff` matches the
+    whole files just as ``unified_diff`` does.
+    """
+    groups = _diff_groups(current_content, reference_content)
+    if not groups:
+        return ""
+    out = [f"--- a/{ref_path}\n+++ b/{ref_path}\n"]
+    for _start, _count, header, raw_lines in groups:
+        out.append(header + "\n")
+        out.extend(raw_lines)
+    return "".join(out)
+
+
+def _grouped_diff(current_content, reference_content, context=3):
+    """Yield ``(old_start, old_count, header, lines)`` for each diff hunk.
+
+    *lines* are prefixed with ``" "``, ``"-"`` or ``"+"`` and keep their
+    original line endings.
+    """
+    if current_content == reference_content:
+        return
+
+    # The matcher sees the whole files: trimming a common prefix/suffix
+    # first lets it realign repeated lines (M98, blank lines) differently
+    # from difflib.unified_diff, losing context or regrouping hunks.
+    old_lines = current_content.splitlines(keepends=True)
+    new_lines = reference_content.splitlines(keepends=True)
+
+    # Build hunks straight from the matcher's grouped opcodes rather than
+    # formatting a unified diff and parsing it back.
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
+    for group in matcher.get_grouped_opcodes(context):
+        first, last = group[0], group[-1]
+        old_start, old_count = _unified_range(first[1], last[2])
+        new_start, new_count = _unified_range(first[3], last[4])
+        header = "@@ -{} +{} @@".format(
+            _format_range(old_start, old_count),
+            _format_range(new_start, new_count),
+        )
+        lines = []
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                lines.extend(" " + l for l in old_lines[i1:i2])
+                continue
+            lines.extend("-" + l for l in old_lines[i1:i2])
+            lines.extend("+" + l for l in new_lines[j1:j2])
+        yield old_start, old_count, header, lines
+
+
+def _unified_range(start, stop):
+    """Convert a 0-based ``[start, stop)`` range to unified-diff ``(start, count)``.
+
+    Empty ranges name the line *before* the change, as in ``diff -u``.
+    """
+    length = stop - start
+    if length == 0:
+        return start, 0
+    return start + 1, length
+
+
+def _format_range(start, count):
+    """Format a unified-diff ``(start, count)`` pair for a hunk header."""
+    if count == 1:
+        return f"{start}"
+    return f"{start},{count}"
+
+
+def _scan_range(header, i):
+    """Scan ``start[,count]`` beginning at index *i* of a hunk header.
+
+    Returns ``(start, count, end)`` where *end* is the index just past the
+    range, or ``None`` if no digits are found.  Count defaults to 1.
+    """
+    n = len(header)
+    j = i
+    while j < n and header[j].isdecimal():
+        j += 1
+    if j == i:
+        return None
+    start = int(header[i:j])
+    count = 1
+    if j < n and header[j] == ",":
+        k = j + 1
+        while k < n and header[k].isdecimal():
+            k += 1
+        if k == j + 1:
+            return None
+        count = int(header[j + 1:k])
+        j = k
+    return start, count, j
 
 
 def _parse_hunk_header(header):
-    """Parse @@ line numbers from a hunk header."""
-    m = _HUNK_HEADER_RE.match(header)
-    if not m:
+    """Parse @@ line numbers from a hunk header.
+
+    Hand-written scanner for the fixed ``@@ -a[,b] +c[,d] @@`` format;
+    avoids running the regex engine once per hunk.
+    """
+    if not header.startswith("@@ -"):
+        return None
+    old = _scan_range(header, 4)
+    if old is None or not header.startswith(" +", old[2]):
+        return None
+    new = _scan_range(header, old[2] + 2)
+    if new is None or not header.startswith(" @@", new[2]):
         return None
     return {
-        "old_start": int(m.group(1)),
-        "old_count": int(m.group(2)) if m.group(2) else 1,
-        "new_start": int(m.group(3)),
-        "new_count": int(m.group(4)) if m.group(4) else 1,
+        "old_start": old[0],
+        "old_count": old[1],
+        "new_start": new[0],
+        "new_count": new[1],
     }
 
 
-def _apply_single_hunk(lines, hunk, offset):
-    """Apply a single hunk to a list of lines.
+def _match_context(lines, expected, start):
+    """Check that *expected* matches *lines* from *start*, ignoring newlines.
 
-    Args:
-        lines: Current file lines (with newlines).
-        hunk: Hunk dict with header and lines.
-        offset: Line offset accumulated from previously applied hunks.
-
-    Returns:
-        (success, new_lines, new_offset)
+    Compares pairwise and stops at the first mismatch instead of building
+    stripped copies of both ranges.  Hunk lines normally carry no newline,
+    so only the file side is stripped on the common path; CPython compares
+    equal-kind strings with ``memcmp``.  The caller guarantees the range
+    fits.
     """
-    parsed = _parse_hunk_header(hunk["header"])
-    if parsed is None:
-        return False, lines, offset
+    for have, want in zip(lines[start:start + len(expected)], expected):
+        have = have.rstrip("\n")
+        if have != want and have != want.rstrip("\n"):
+            return False
+    return True
 
-    # old_start is 1-based in diff output
-    start = parsed["old_start"] - 1 + offset
 
-    # Split hunk lines into context/remove/add
+def _split_hunk_lines(hunk):
+    """Split a hunk's diff lines into the ``(old, new)`` lines they describe."""
     old_lines = []
     new_lines = []
     for line in hunk["lines"]:
-        if line.startswith("-"):
-            old_lines.append(line[1:])
-        elif line.startswith("+"):
-            new_lines.append(line[1:])
-        elif line.startswith(" "):
+        # One slice + plain compares is cheaper than three startswith calls
+        tag = line[:1]
+        if tag == "-":
             old_lines.append(line[1:])
+        elif tag == "+":
             new_lines.append(line[1:])
+        elif tag == " ":
+            line = line[1:]
+            old_lines.append(line)
+            new_lines.append(line)
         else:
             # No-newline-at-end marker or other, treat as context
             old_lines.append(line)
             new_lines.append(line)
+    return old_lines, new_lines
 
-    # Verify context matches
-    end = start + len(old_lines)
-    if end > len(lines):
-        return False, lines, offset
 
-    actual = [l.rstrip("\n") for l in lines[start:end]]
-    expected = [l.rstrip("\n") for l in old_lines]
-    if actual != expected:
-        return False, lines, offset
+def _apply_hunks(lines, hunks, offset=0):
+    """Apply several hunks to a list of lines in a single merge pass.
+
+    *hunks* must be sorted and non-overlapping, as produced by
+    :func:`_diff_hunks`.  Each hunk is checked against the original
+    *lines*, shifted by *offset*; a hunk whose context does not match is
+    skipped.  Unchanged ranges are copied once, so the cost is
+    O(lines + hunk lines) instead of O(lines) per hunk.
+
+    Returns:
+        (new_lines, results) where ``results[i]`` tells whether
+        ``hunks[i]`` was applied.
+    """
+    output = []
+    results = []
+    cursor = 0
+
+    for hunk in hunks:
+        parsed = _parse_hunk_header(hunk["header"])
+        if parsed is None:
+            results.append(False)
+            continue
+        old_lines, new_lines = _split_hunk_lines(hunk)
+        # A pure insertion's start is the line *before* the insert point.
+        start = parsed["old_start"] + offset
+        if old_lines:
+            start -= 1
+        end = start + len(old_lines)
+        if (
+            start < cursor
+            or end > len(lines)
+            or not _match_context(lines, old_lines, start)
+        ):
+            results.append(False)
+            continue
+        output.extend(lines[cursor:start])
+        output.extend(l + "\n" for l in new_lines)
+        cursor = end
+        results.append(True)
+
+    output.extend(lines[cursor:])
+    return output, results
 
-    # Apply: replace old lines with new lines
-    new_file_lines = (
-        lines[:start]
-        + [l + "\n" for l in new_lines]
-        + lines[end:]
-    )
-    new_offset = offset + len(new_lines) - len(old_lines)
-    return True, new_file_lines, new_offset
+
+def _apply_single_hunk(lines, hunk, offset):
+    """Apply a single hunk to a list of lines.
+
+    Args:
+        lines: Current file lines (with newlines).
+        hunk: Hunk dict with header and lines.
+        offset: Line offset accumulated from previously applied hunks.
+
+    Returns:
+        (success, new_lines, new_offset)
+    """
+    new_lines, (applied,) = _apply_hunks(lines, [hunk], offset)
+    if not applied:
+        return False, lines, offset
+    return True, new_lines, offset + len(new_lines) - len(lines)
 
 
 def _hunk_summary(hunk):
@@ -723,8 +1131,12 @@ def _hunk_summary(hunk):
     parsed = _parse_hunk_header(hunk["header"])
     if parsed is None:
         return ""
-    start = parsed["old_start"]
-    end = start + parsed["old_count"] - 1
+    return _summary_text(parsed["old_start"], parsed["old_count"])
+
+
+def _summary_text(start, count):
+    """Format the ``Line N`` / ``Lines N-M`` summary for an old-file range."""
+    end = start + count - 1
     if start == end:
         return f"Line {start}"
     return f"Lines {start}-{end}"
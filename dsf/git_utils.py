@@ -20,12 +20,18 @@ if GIT_BIN is None:
     GIT_BIN = "git"  # last resort — will fail with a clear error at runtime
     logger.warning("Could not locate git binary; commands will likely fail")
 
+# Prefix of the temporary files used for atomic printer writes.  A backup
+# taken mid-write must not commit them, so staging always excludes them.
+TEMP_FILE_PREFIX = ".mpc-"
+_EXCLUDE_TEMP_FILES = f":(exclude,glob)**/{TEMP_FILE_PREFIX}*"
 
-def _run(args, cwd=None, git_dir=None):
-    """Run a git command and return stdout.
+
+def _git(args, cwd=None, git_dir=None, input=None):
+    """Run a git command and return its raw stdout bytes.
 
     If *git_dir* is given, ``--git-dir <git_dir>`` is prepended so that
-    git finds the repository even when *cwd* is not inside it.
+    git finds the repository even when *cwd* is not inside it.  Raises
+    RuntimeError if git is missing or exits non-zero.
     """
     cmd = [GIT_BIN]
     if git_dir:
@@ -36,8 +42,8 @@ def _run(args, cwd=None, git_dir=None):
         result = subprocess.run(
             cmd,
             cwd=cwd,
+            input=input,
             capture_output=True,
-            text=True,
             timeout=120,
         )
     except FileNotFoundError:
@@ -46,10 +52,21 @@ def _run(args, cwd=None, git_dir=None):
             "Ensure git is installed (apt install git)."
         ) from None
     if result.returncode != 0:
+        stderr = result.stderr.decode("utf-8", errors="replace").strip()
         raise RuntimeError(
-            f"git {args[0]} failed (rc={result.returncode}): {result.stderr.strip()}"
+            f"git {args[0]} failed (rc={result.returncode}): {stderr}"
         )
-    return result.stdout.strip()
+    return result.stdout
+
+
+def _decode(data):
+    """Decode git output the way ``text=True`` would: UTF-8, universal newlines."""
+    return data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+
+def _run(args, cwd=None, git_dir=None):
+    """Run a git command and return its stripped stdout as text."""
+    return _decode(_git(args, cwd=cwd, git_dir=git_dir)).strip()
 
 
 # --- Reference repository operations ---
@@ -187,7 +204,8 @@ def backup_commit(backup_path, message, paths=None, force=False):
 
     If *paths* is given (a list of directory/file names relative to the
     worktree root), only those paths are staged.  Otherwise all changes
-    are staged (``git add -A``).
+    are staged (``git add -A``).  Temporary files from in-progress
+    printer writes (:data:`TEMP_FILE_PREFIX`) are never staged.
 
     If *force* is True, a commit is created even when there are no
     staged changes (``--allow-empty``).  This is used for full backups
@@ -195,9 +213,10 @@ def backup_commit(backup_path, message, paths=None, force=False):
     """
     cwd, git_dir = _backup_cwd(backup_path)
     if paths:
-        _run(["add", "-A", "--"] + list(paths), cwd=cwd, git_dir=git_dir)
+        pathspecs = list(paths) + [_EXCLUDE_TEMP_FILES]
     else:
-        _run(["add", "-A"], cwd=cwd, git_dir=git_dir)
+        pathspecs = [".", _EXCLUDE_TEMP_FILES]
+    _run(["add", "-A", "--"] + pathspecs, cwd=cwd, git_dir=git_dir)
     # Check if there's anything to commit
     diff_cmd = [GIT_BIN]
     if git_dir:
@@ -329,6 +348,43 @@ def backup_file_content(backup_path, commit_hash, file_path):
     return _run(["show", f"{commit_hash}:{file_path}"], cwd=backup_path)
 
 
+def backup_file_contents(backup_path, revisions):
+    """Read several ``(commit, file_path)`` blobs with one git process.
+
+    Uses ``git cat-file --batch`` so callers that need multiple versions of
+    a file (e.g. a commit and its parent) share a single subprocess.
+    Returns a list aligned with *revisions*; entries that do not exist are
+    ``None``.  Content is decoded and stripped like
+    :func:`backup_file_content`.
+    """
+    names = [f"{commit}:{path}" for commit, path in revisions]
+    request = "".join(
+        f"{name}\n" for name in names if "\n" not in name
+    ).encode("utf-8")
+    out = _git(["cat-file", "--batch"], cwd=backup_path, input=request)
+    pos = 0
+    contents = []
+    for name in names:
+        if "\n" in name:
+            contents.append(None)
+            continue
+        eol = out.index(b"\n", pos)
+        header = out[pos:eol].decode("utf-8", errors="replace")
+        pos = eol + 1
+        parts = header.rsplit(" ", 2)
+        if len(parts) != 3 or parts[1] != "blob":
+            # "<name> missing", "<name> ambiguous" or a non-blob object
+            if len(parts) == 3 and parts[2].isdigit():
+                pos += int(parts[2]) + 1
+            contents.append(None)
+            continue
+        size = int(parts[2])
+        data = out[pos:pos + size]
+        pos += size + 1  # object data is followed by a newline
+        contents.append(_decode(data).strip())
+    return contents
+
+
 def backup_archive(backup_path, commit_hash):
     """Create a ZIP archive of a backup commit. Returns bytes."""
     cwd, git_dir = _backup_cwd(backup_path)
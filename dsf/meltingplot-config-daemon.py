@@ -5,6 +5,7 @@ Connects to DSF via Unix socket, registers HTTP endpoints, and handles
 config sync / diff / apply requests from the DWC frontend.
 """
 
+import functools
 import json
 import logging
 import os
@@ -188,6 +189,31 @@ def save_settings_to_disk(updates):
         logger.warning("Failed to save settings to disk: %s", exc)
 
 
+# Last detected firmware version.  Used as a fallback when the object model
+# cannot be read at startup (e.g. DSF still starting while the daemon is
+# restarted in a loop during installation).
+FIRMWARE_CACHE_FILE = os.path.join(DATA_DIR, "firmware-version.txt")
+
+
+def load_cached_firmware_version():
+    """Return the last detected firmware version, or "" if unknown."""
+    try:
+        with open(FIRMWARE_CACHE_FILE, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return ""
+
+
+def save_cached_firmware_version(version):
+    """Persist the detected firmware version for the next startup."""
+    try:
+        os.makedirs(os.path.dirname(FIRMWARE_CACHE_FILE), exist_ok=True)
+        with open(FIRMWARE_CACHE_FILE, "w", encoding="utf-8") as f:
+            f.write(version)
+    except (IOError, OSError) as exc:
+        logger.warning("Failed to cache firmware version: %s", exc)
+
+
 # --- Directory mapping from DSF object model ---
 
 # Known directory property names on the DSF Directories object (snake_case).
@@ -257,16 +283,53 @@ def set_plugin_data(cmd, key, value):
 
 # --- JSON response helpers ---
 
+# orjson is used for request/response (de)serialization when available;
+# it is optional, so fall back to the stdlib json module.  The fallback
+# is configured to emit the same compact, non-ASCII-escaped text as
+# orjson.  orjson's JSONDecodeError subclasses json.JSONDecodeError, so
+# callers can keep catching the stdlib exception.
+try:
+    import orjson
+
+    def _dumps(obj):
+        return orjson.dumps(obj).decode("utf-8")
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    _loads = json.loads
+
+
+# Upper bounds on POST request bodies, checked before any JSON parsing.
+# The largest legitimate body is an applyHunks selection, which is far
+# below both limits.  MAX_BODY_SIZE is in UTF-8 bytes.
+MAX_BODY_SIZE = 8192
+MAX_HUNK_SELECTION = 1024
+
 
 def json_response(body, status=200):
     """Create a JSON response dict."""
-    return {"status": status, "body": json.dumps(body), "contentType": "application/json"}
+    return {"status": status, "body": _dumps(body), "contentType": "application/json"}
 
 
 def error_response(message, status=400):
     return json_response({"error": message}, status=status)
 
 
+def body_too_large(body):
+    """Return True if *body* exceeds ``MAX_BODY_SIZE`` bytes as UTF-8."""
+    # Every character is at least one byte, so long bodies skip the encode.
+    return len(body) > MAX_BODY_SIZE or len(body.encode("utf-8")) > MAX_BODY_SIZE
+
+
+def body_too_large_response():
+    return error_response(
+        f"Request body too large (max {MAX_BODY_SIZE} bytes)", status=413
+    )
+
+
 # --- HTTP endpoint handlers ---
 # Each handler takes (cmd, manager, body, queries) and returns a response dict.
 
@@ -339,13 +402,7 @@ def handle_diff(_cmd, manager, _body, queries):
 
 def handle_reference(_cmd, manager, _body, _queries):
     """GET /machine/MeltingplotConfig/reference"""
-    from git_utils import list_files
-    from config_manager import REFERENCE_DIR, is_protected
-    import os
-    if not os.path.isdir(os.path.join(REFERENCE_DIR, ".git")):
-        return json_response({"files": []})
-    files = [f for f in list_files(REFERENCE_DIR) if not is_protected(f)]
-    return json_response({"files": files})
+    return json_response({"files": manager.get_reference_files()})
 
 
 def handle_backups(_cmd, manager, _body, _queries):
@@ -377,13 +434,17 @@ def handle_apply_hunks(_cmd, manager, body, queries):
     file_param = queries.get("file", "")
     if not file_param:
         return error_response("File path required (use ?file= query param)")
+    if body_too_large(body):
+        return body_too_large_response()
     try:
-        data = json.loads(body) if body else {}
+        data = _loads(body) if body else {}
     except json.JSONDecodeError:
         return error_response("Invalid JSON body")
     hunk_indices = data.get("hunks", [])
     if not isinstance(hunk_indices, list):
         return error_response("'hunks' must be a list of indices")
+    if len(hunk_indices) > MAX_HUNK_SELECTION:
+        return error_response(f"Too many hunks selected (max {MAX_HUNK_SELECTION})")
     result = manager.apply_hunks(unquote(file_param), hunk_indices)
     if "error" in result:
         return error_response(result["error"])
@@ -396,9 +457,11 @@ def handle_manual_backup(_cmd, manager, body, _queries):
     Body (optional): {"message": "My backup note"}
     """
     message = ""
+    if body_too_large(body):
+        return body_too_large_response()
     if body:
         try:
-            data = json.loads(body)
+            data = _loads(body)
             message = data.get("message", "")
         except json.JSONDecodeError:
             return error_response("Invalid JSON body")
@@ -493,8 +556,10 @@ def handle_delete_backup(_cmd, manager, _body, queries):
 
 def handle_settings(cmd, _manager, body, _queries):
     """POST /machine/MeltingplotConfig/settings"""
+    if body_too_large(body):
+        return body_too_large_response()
     try:
-        data = json.loads(body) if body else {}
+        data = _loads(body) if body else {}
     except json.JSONDecodeError:
         return error_response("Invalid JSON body")
 
@@ -514,7 +579,8 @@ def handle_settings(cmd, _manager, body, _queries):
 
 # --- Endpoint registry ---
 # Maps (HTTP_METHOD, endpoint_path) to handler function.
-# Each DSF endpoint path is registered individually with its own async handler.
+# Each DSF endpoint path is registered individually; all of them share the
+# _dispatch coroutine, which looks up the handler here per request.
 
 ENDPOINTS = {
     ("GET", "status"): handle_status,
@@ -536,41 +602,46 @@ ENDPOINTS = {
 }
 
 
-# --- Async handler factory ---
+# --- Shared async dispatcher ---
 
 
-def _make_async_handler(cmd, manager, handler_func):
-    """Create an async HTTP handler for a dsf-python endpoint."""
-    async def _handler(http_conn):
-        request = await http_conn.read_request()
-        try:
-            queries = getattr(request, "queries", {}) or {}
-            body = getattr(request, "body", "") or ""
-            response = handler_func(cmd, manager, body, queries)
-
-            content_type = response.get("contentType", "application/json")
-            resp_type_str = response.get("responseType", "")
+async def _dispatch(cmd, manager, endpoint_key, http_conn):
+    """Serve one HTTP request for the endpoint identified by *endpoint_key*.
 
-            if resp_type_str == "file":
-                resp_type = HttpResponseType.File
-            elif content_type == "application/json":
-                resp_type = HttpResponseType.JSON
-            else:
-                resp_type = HttpResponseType.PlainText
+    dsf-python calls endpoint handlers with only the connection object,
+    which does not carry the endpoint path, so register_endpoints binds
+    ``(cmd, manager, endpoint_key)`` with functools.partial and the
+    handler function is looked up in ENDPOINTS.
+    """
+    request = await http_conn.read_request()
+    try:
+        handler_func = ENDPOINTS[endpoint_key]
+        queries = getattr(request, "queries", {}) or {}
+        body = getattr(request, "body", "") or ""
+        response = handler_func(cmd, manager, body, queries)
+
+        content_type = response.get("contentType", "application/json")
+        resp_type_str = response.get("responseType", "")
+
+        if resp_type_str == "file":
+            resp_type = HttpResponseType.File
+        elif content_type == "application/json":
+            resp_type = HttpResponseType.JSON
+        else:
+            resp_type = HttpResponseType.PlainText
 
-            await http_conn.send_response(
-                response.get("status", 200),
-                response.get("body", ""),
-                resp_type,
-            )
-        except Exception:
-            logger.error("Handler error: %s", traceback.format_exc())
-            await http_conn.send_response(
-                500,
-                json.dumps({"error": "Internal server error"}),
-                HttpResponseType.JSON,
-            )
-    return _handler
+        await http_conn.send_response(
+            response.get("status", 200),
+            response.get("body", ""),
+            resp_type,
+        )
+    except Exception:
+        logger.error("Handler error: %s", traceback.format_exc())
+        await http_conn.send_response(
+            500,
+            _dumps({"error": "Internal server error"}),
+            HttpResponseType.JSON,
+        )
 
 
 # --- Registration and main ---
@@ -579,12 +650,12 @@ def _make_async_handler(cmd, manager, handler_func):
 def register_endpoints(cmd, manager):
     """Register all HTTP endpoints with DSF and set async handlers."""
     registered = []
-    for (method, path), handler_func in ENDPOINTS.items():
+    for method, path in ENDPOINTS:
         http_type = HttpEndpointType.GET if method == "GET" else HttpEndpointType.POST
         try:
             endpoint = cmd.add_http_endpoint(http_type, API_NAMESPACE, path)
             endpoint.set_endpoint_handler(
-                _make_async_handler(cmd, manager, handler_func)
+                functools.partial(_dispatch, cmd, manager, (method, path))
             )
             registered.append(endpoint)
             logger.debug("Registered endpoint: %s /%s/%s", method, API_NAMESPACE, path)
@@ -613,6 +684,7 @@ def main():
     # Read object model once at startup for firmware version + directory mappings
     dir_map = None
     fw_version = ""
+    cached_fw_version = load_cached_firmware_version()
     try:
         model = cmd.get_object_model()
 
@@ -620,8 +692,6 @@ def main():
         boards = getattr(model, "boards", None) or []
         if boards:
             fw_version = getattr(boards[0], "firmware_version", "") or ""
-            if fw_version:
-                set_plugin_data(cmd, "detectedFirmwareVersion", fw_version)
 
         # Build directory mapping from object model
         dir_map = build_directory_map(model)
@@ -630,6 +700,15 @@ def main():
     except Exception as exc:
         logger.warning("Could not read object model: %s", exc)
 
+    if fw_version:
+        if fw_version != cached_fw_version:
+            save_cached_firmware_version(fw_version)
+    elif cached_fw_version:
+        fw_version = cached_fw_version
+        logger.info("Using last detected firmware version %s", fw_version)
+    if fw_version:
+        set_plugin_data(cmd, "detectedFirmwareVersion", fw_version)
+
     # Resolve virtual printer paths to real filesystem paths via DSF.
     # e.g. "0:/sys/" -> "/opt/dsf/sd/sys/"
     from config_manager import DEFAULT_DIRECTORY_MAP
@@ -657,7 +736,7 @@ def main():
         resolved_dirs=resolved_dirs if resolved_dirs else None,
     )
 
-    # Register HTTP endpoints (each runs in its own async handler thread)
+    # Register HTTP endpoints (all share the _dispatch coroutine)
     endpoints = register_endpoints(cmd, manager)
 
     fw_info = f", firmware {fw_version}" if fw_version else ""
@@ -0,0 +1,98 @@
+"""Shared test fixtures."""
+
+import os
+import sys
+import types
+from unittest.mock import MagicMock
+
+import pytest
+
+
+# The daemon imports dsf.* which isn't available in test. We need to mock
+# those modules before importing the daemon.
+
+
+def _build_fake_dsf_modules():
+    """Build stand-in dsf library modules, keyed by module name."""
+    dsf_mod = types.ModuleType("dsf")
+    dsf_connections = types.ModuleType("dsf.connections")
+    dsf_commands = types.ModuleType("dsf.commands")
+    dsf_commands_code = types.ModuleType("dsf.commands.code")
+    dsf_http = types.ModuleType("dsf.http")
+    dsf_object_model = types.ModuleType("dsf.object_model")
+
+    # Only the connections the daemon instantiates need to be mocks.
+    dsf_connections.CommandConnection = MagicMock
+    dsf_connections.InterceptConnection = type("InterceptConnection", (), {})
+    dsf_commands_code.CodeResult = type("CodeResult", (), {})
+
+    class FakeHttpEndpointType:
+        GET = "GET"
+        POST = "POST"
+
+    class FakeHttpResponseType:
+        StatusCode = "StatusCode"
+        PlainText = "PlainText"
+        JSON = "JSON"
+        File = "File"
+        URI = "URI"
+
+    dsf_http.HttpEndpointConnection = MagicMock
+    dsf_http.HttpResponseType = FakeHttpResponseType
+    dsf_object_model.HttpEndpointType = FakeHttpEndpointType
+
+    return {
+        "dsf": dsf_mod,
+        "dsf.connections": dsf_connections,
+        "dsf.commands": dsf_commands,
+        "dsf.commands.code": dsf_commands_code,
+        "dsf.http": dsf_http,
+        "dsf.object_model": dsf_object_model,
+    }
+
+
+# Built once: the fake modules only hold constants and classes, which no
+# test modifies.
+FAKE_DSF_MODULES = _build_fake_dsf_modules()
+
+
+@pytest.fixture(scope="session")
+def fake_dsf_modules():
+    """Install the fake dsf modules in ``sys.modules`` for the session."""
+    with pytest.MonkeyPatch.context() as mp:
+        for name, module in FAKE_DSF_MODULES.items():
+            mp.setitem(sys.modules, name, module)
+        yield FAKE_DSF_MODULES
+
+
+DAEMON_PATH = os.path.normpath(os.path.join(
+    os.path.dirname(__file__), "..", "dsf", "meltingplot-config-daemon.py"
+))
+
+# Compiled once; each _import_daemon() call still executes a fresh module.
+with open(DAEMON_PATH, encoding="utf-8") as _f:
+    _DAEMON_CODE = compile(_f.read(), DAEMON_PATH, "exec")
+
+
+def _import_daemon():
+    """Import (or reimport) the daemon module."""
+    mod = types.ModuleType("daemon_mod")
+    mod.__file__ = DAEMON_PATH
+    exec(_DAEMON_CODE, mod.__dict__)
+    return mod
+
+
+@pytest.fixture(scope="session")
+def daemon(fake_dsf_modules):
+    """The daemon module, loaded once and shared by the handler tests.
+
+    Handlers are plain functions of their arguments and module state is
+    patched per test, so tests do not need a fresh module.
+    """
+    return _import_daemon()
+
+
+@pytest.fixture
+def import_daemon(fake_dsf_modules):
+    """Return a loader for tests that need a freshly imported daemon."""
+    return _import_daemon
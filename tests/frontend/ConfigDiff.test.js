@@ -61,6 +61,7 @@ describe('ConfigDiff', () => {
       expect(wrapper.vm.fileStatusColor('modified')).toBe('warning')
       expect(wrapper.vm.fileStatusColor('missing')).toBe('info')
       expect(wrapper.vm.fileStatusColor('extra')).toBe('grey')
+      expect(wrapper.vm.fileStatusColor('too_large')).toBe('error')
       expect(wrapper.vm.fileStatusColor('unknown')).toBe('warning')
     })
 
@@ -69,6 +70,7 @@ describe('ConfigDiff', () => {
       expect(wrapper.vm.fileStatusIcon('modified')).toBe('mdi-file-document-edit')
       expect(wrapper.vm.fileStatusIcon('missing')).toBe('mdi-file-plus')
       expect(wrapper.vm.fileStatusIcon('extra')).toBe('mdi-file-question')
+      expect(wrapper.vm.fileStatusIcon('too_large')).toBe('mdi-file-alert')
     })
 
     it('parseHunkHeader parses standard hunk header', () => {
@@ -140,7 +140,7 @@ function assertHasKeys(obj, keys, label) {
 function assertFileShape(file) {
   assertHasKeys(file, ['file', 'status'], 'diff file')
   expect(typeof file.file).toBe('string')
-  expect(['modified', 'unchanged', 'missing', 'extra', 'not_in_reference']).toContain(file.status)
+  expect(['modified', 'unchanged', 'missing', 'extra', 'not_in_reference', 'too_large']).toContain(file.status)
 }
 
 function assertSummaryHunkShape(hunk) {
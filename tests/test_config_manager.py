@@ -1,15 +1,25 @@
 """Tests for config_manager.py — diff engine, hunk parsing, hunk apply."""
 
+import difflib
+import random
+from unittest.mock import patch
+
 import pytest
 
 from config_manager import (
     BACKUP_INCLUDED_DIRS,
+    DIFF_CACHE_SIZE,
     PROTECTED_FILES,
     ConfigManager,
+    _apply_hunks,
     _apply_single_hunk,
+    _clear_diff_cache,
+    _diff_cache,
+    _diff_groups,
     _friendly_network_error,
     _hunk_summary,
     _parse_hunk_header,
+    _unified_diff_text,
     is_protected,
 )
 
@@ -57,6 +67,18 @@ class TestParseHunkHeader:
         assert _parse_hunk_header("not a header") is None
         assert _parse_hunk_header("") is None
 
+    def test_zero_count(self):
+        result = _parse_hunk_header("@@ -0,0 +1,2 @@")
+        assert result["old_start"] == 0
+        assert result["old_count"] == 0
+
+    def test_malformed_ranges(self):
+        assert _parse_hunk_header("@@ -1, +1 @@") is None
+        assert _parse_hunk_header("@@ -a +1 @@") is None
+        assert _parse_hunk_header("@@ -1 +1") is None
+        assert _parse_hunk_header("@@ -1 -1 @@") is None
+        assert _parse_hunk_header("@@ -1 +1,x @@") is None
+
 
 # --- Hunk summary ---
 
@@ -178,6 +200,97 @@ class TestApplySingleHunk:
         success, new_lines, offset = _apply_single_hunk(lines, hunk, 0)
         assert success is False
 
+    def test_single_line_replace(self):
+        lines = ["a\n", "b\n", "c\n"]
+        hunk = {"header": "@@ -2 +2 @@", "lines": ["-b", "+B"]}
+        success, new_lines, offset = _apply_single_hunk(lines, hunk, 0)
+        assert success is True
+        assert offset == 0
+        assert new_lines == ["a\n", "B\n", "c\n"]
+
+    def test_single_line_replace_mismatch(self):
+        lines = ["a\n", "b\n"]
+        hunk = {"header": "@@ -3 +3 @@", "lines": ["-c", "+C"]}
+        success, new_lines, offset = _apply_single_hunk(lines, hunk, 0)
+        assert success is False
+        assert new_lines == ["a\n", "b\n"]
+
+    def test_pure_insertion(self):
+        lines = ["a\n", "b\n"]
+        hunk = {"header": "@@ -1,0 +2,2 @@", "lines": ["+x", "+y"]}
+        success, new_lines, offset = _apply_single_hunk(lines, hunk, 0)
+        assert success is True
+        assert offset == 2
+        assert new_lines == ["a\n", "x\n", "y\n", "b\n"]
+
+    def test_pure_insertion_into_empty_file(self):
+        hunk = {"header": "@@ -0,0 +1,2 @@", "lines": ["+G28", "+M80"]}
+        success, new_lines, offset = _apply_single_hunk([], hunk, 0)
+        assert success is True
+        assert new_lines == ["G28\n", "M80\n"]
+
+    def test_failure_leaves_list_untouched(self):
+        lines = ["a\n", "b\n", "c\n"]
+        hunk = {"header": "@@ -2 +2 @@", "lines": ["-x", "+B"]}
+        success, new_lines, offset = _apply_single_hunk(lines, hunk, 0)
+        assert success is False
+        assert lines == ["a\n", "b\n", "c\n"]
+
+    def test_context_ignores_trailing_newline(self):
+        """Last file line without newline still matches hunk context."""
+        lines = ["a\n", "b"]
+        hunk = {
+            "header": "@@ -1,2 +1,2 @@",
+            "lines": [" a", "-b", "+c"],
+        }
+        success, new_lines, offset = _apply_single_hunk(lines, hunk, 0)
+        assert success is True
+        assert new_lines == ["a\n", "c\n"]
+
+
+# --- Applying several hunks ---
+
+
+class TestApplyHunks:
+    """Tests for the single-pass multi-hunk applier."""
+
+    def test_matches_sequential_apply(self):
+        current_lines = [f"line{i}\n" for i in range(40)]
+        reference_lines = list(current_lines)
+        reference_lines.insert(5, "ADDED_A\n")
+        del reference_lines[20]
+        reference_lines[33] = "CHANGED_C\n"
+        current = "".join(current_lines)
+        reference = "".join(reference_lines)
+        hunks = ConfigManager._compute_hunks(current, reference)
+
+        result_lines, results = _apply_hunks(current.splitlines(keepends=True), hunks)
+        assert results == [True] * len(hunks)
+        assert "".join(result_lines) == reference
+
+    def test_failed_hunk_is_skipped(self):
+        current_lines = [f"line{i}\n" for i in range(30)]
+        reference_lines = list(current_lines)
+        reference_lines[2] = "CHANGED_A\n"
+        reference_lines[27] = "CHANGED_B\n"
+        hunks = ConfigManager._compute_hunks(
+            "".join(current_lines), "".join(reference_lines)
+        )
+        drifted = list(current_lines)
+        drifted[1] = "edited on printer\n"
+
+        result_lines, results = _apply_hunks(drifted, hunks)
+        assert results == [False, True]
+        assert result_lines[1] == "edited on printer\n"
+        assert result_lines[2] == "line2\n"
+        assert result_lines[27] == "CHANGED_B\n"
+
+    def test_insert_into_empty_file(self):
+        hunks = ConfigManager._compute_hunks("", "G28\nM80\n")
+        result_lines, results = _apply_hunks([], hunks)
+        assert results == [True]
+        assert result_lines == ["G28\n", "M80\n"]
+
 
 # --- Computing hunks from diffs ---
 
@@ -186,7 +299,7 @@ class TestComputeHunks:
     def test_single_hunk(self):
         current = "line1\nold_line\nline3\n"
         reference = "line1\nnew_line\nline3\n"
-        hunks = ConfigManager._compute_hunks("test.g", current, reference)
+        hunks = ConfigManager._compute_hunks(current, reference)
         assert len(hunks) == 1
         assert hunks[0]["index"] == 0
         assert hunks[0]["header"].startswith("@@")
@@ -201,24 +314,184 @@ class TestComputeHunks:
         reference_lines[27] = "CHANGED_B\n"
         current = "".join(current_lines)
         reference = "".join(reference_lines)
-        hunks = ConfigManager._compute_hunks("test.g", current, reference)
+        hunks = ConfigManager._compute_hunks(current, reference)
         assert len(hunks) >= 2
         assert hunks[0]["index"] == 0
         assert hunks[1]["index"] == 1
 
     def test_no_changes(self):
         content = "line1\nline2\n"
-        hunks = ConfigManager._compute_hunks("test.g", content, content)
+        hunks = ConfigManager._compute_hunks(content, content)
         assert len(hunks) == 0
 
     def test_hunk_summaries(self):
         current = "line1\nold\nline3\n"
         reference = "line1\nnew\nline3\n"
-        hunks = ConfigManager._compute_hunks("test.g", current, reference)
+        hunks = ConfigManager._compute_hunks(current, reference)
         assert len(hunks) == 1
         assert hunks[0]["summary"] != ""
         assert "Line" in hunks[0]["summary"]
 
+    def test_no_changes_skips_difflib(self):
+        content = "line1\nline2\n"
+        _clear_diff_cache()
+        with patch("config_manager.difflib.SequenceMatcher") as mock_matcher:
+            assert ConfigManager._compute_hunks(content, content) == []
+        mock_matcher.assert_not_called()
+
+    def test_common_prefix_suffix_keeps_line_numbers(self):
+        current_lines = [f"line{i}\n" for i in range(40)]
+        reference_lines = list(current_lines)
+        reference_lines[19] = "CHANGED\n"
+        reference_lines.insert(30, "ADDED\n")
+        current = "".join(current_lines)
+        reference = "".join(reference_lines)
+        hunks = ConfigManager._compute_hunks(current, reference)
+        assert [h["header"] for h in hunks] == [
+            "@@ -17,7 +17,7 @@",
+            "@@ -28,6 +28,7 @@",
+        ]
+        assert hunks[0]["lines"][0] == " line16"
+        assert hunks[0]["summary"] == "Lines 17-23"
+
+    def test_repeated_diff_is_cached(self):
+        current = "line1\ncached_old\nline3\n"
+        reference = "line1\ncached_new\nline3\n"
+        _clear_diff_cache()
+        with patch("config_manager.difflib.SequenceMatcher", wraps=difflib.SequenceMatcher) as mock_matcher:
+            first = ConfigManager._compute_hunks(current, reference)
+            second = ConfigManager._compute_hunks(current, reference)
+        assert mock_matcher.call_count == 1
+        assert first == second
+
+    def test_diff_cache_is_bounded_and_keyed_on_digests(self):
+        _clear_diff_cache()
+        for i in range(DIFF_CACHE_SIZE + 10):
+            _diff_groups(f"G28\nM{i}\n", "G28\n")
+        assert len(_diff_cache) == DIFF_CACHE_SIZE
+        for current_digest, reference_digest in _diff_cache:
+            assert isinstance(current_digest, bytes)
+            assert len(current_digest) == 16
+
+    def test_cached_result_not_shared(self):
+        current = "line1\nold\nline3\n"
+        reference = "line1\nnew\nline3\n"
+        first = ConfigManager._compute_hunks(current, reference)
+        first[0]["lines"].clear()
+        first[0]["summary"] = "mutated"
+        second = ConfigManager._compute_hunks(current, reference)
+        assert second[0]["lines"]
+        assert second[0]["summary"] != "mutated"
+
+    def test_hunks_match_unified_diff(self):
+        current_lines = [f"line{i % 7}\n" for i in range(60)]
+        reference_lines = list(current_lines)
+        reference_lines[4] = "CHANGED\n"
+        del reference_lines[30:33]
+        reference_lines.insert(50, "ADDED\n")
+        reference_lines[-1] = "no newline"
+        current = "".join(current_lines)
+        reference = "".join(reference_lines)
+
+        expected = []
+        for line in difflib.unified_diff(
+            current.splitlines(keepends=True), reference.splitlines(keepends=True), n=3
+        ):
+            if line.startswith("@@"):
+                expected.append((line.rstrip("\n"), []))
+            elif expected:
+                expected[-1][1].append(line.rstrip("\n"))
+
+        hunks = ConfigManager._compute_hunks(current, reference)
+        assert [(h["header"], h["lines"]) for h in hunks] == expected
+
+    @pytest.mark.parametrize("current, reference", [
+        ("\nM98\n\n\n\nM98\nM98\n", "\nM98\n\n\nM98\nM98\n"),
+        (
+            "M98\n\n\n\nM98\nG28\nM98\nM98\nM98\nM98\nX\nM98\nG28\n\n",
+            "M98\n\n\n\nG28\nM98\nM98\nM98\nX\nM98\nG28\n\n",
+        ),
+        # Long enough for difflib's autojunk to treat "M98" as popular
+        ("M98\n" * 150 + "G28\n" + "M98\n" * 150, "M98\n" * 149 + "G28\n" + "M98\n" * 152),
+    ], ids=["blank_lines", "m98_runs", "autojunk"])
+    def test_repeated_lines_match_unified_diff(self, current, reference):
+        expected = "".join(difflib.unified_diff(
+            current.splitlines(keepends=True),
+            reference.splitlines(keepends=True),
+            fromfile="a/test.g",
+            tofile="b/test.g",
+        ))
+        assert _unified_diff_text("test.g", current, reference) == expected
+
+
+class TestUnifiedDiffText:
+    def test_matches_difflib(self):
+        current_lines = [f"line{i}\n" for i in range(200)]
+        reference_lines = list(current_lines)
+        reference_lines[1] = "CHANGED\n"
+        del reference_lines[100]
+        reference_lines.append("tail without newline")
+        current = "".join(current_lines)
+        reference = "".join(reference_lines)
+        expected = "".join(difflib.unified_diff(
+            current.splitlines(keepends=True),
+            reference.splitlines(keepends=True),
+            fromfile="a/sys/config.g",
+            tofile="b/sys/config.g",
+        ))
+        assert _unified_diff_text("sys/config.g", current, reference) == expected
+
+    def test_matches_difflib_with_repeated_lines(self):
+        current_lines = []
+        for i in range(40):
+            current_lines += [f"; section {i}\n", 'M98 P"homex.g"\n', "\n", "\n"]
+        reference_lines = list(current_lines)
+        # Drop one of two blank lines; either could be the deleted one
+        del reference_lines[6]
+        current = "".join(current_lines)
+        reference = "".join(reference_lines)
+        expected = "".join(difflib.unified_diff(
+            current_lines,
+            reference_lines,
+            fromfile="a/sys/config.g",
+            tofile="b/sys/config.g",
+        ))
+        assert _unified_diff_text("sys/config.g", current, reference) == expected
+
+    def test_random_repeated_line_edits_match_difflib(self):
+        rng = random.Random(0)
+        alphabet = ["M98\n", "\n", "G28\n", "M584 X0\n"]
+        for _ in range(500):
+            current = [rng.choice(alphabet) for _ in range(rng.randint(0, 30))]
+            reference = list(current)
+            for _ in range(rng.randint(1, 3)):
+                pos = rng.randint(0, len(reference))
+                if reference and rng.random() < 0.5:
+                    del reference[min(pos, len(reference) - 1)]
+                else:
+                    reference.insert(pos, rng.choice(alphabet))
+            expected = "".join(difflib.unified_diff(
+                current, reference, fromfile="a/test.g", tofile="b/test.g"
+            ))
+            assert _unified_diff_text("test.g", "".join(current), "".join(reference)) == expected
+
+    def test_shares_diff_with_hunks(self):
+        current = "G28\nshared_old\n"
+        reference = "G28\nshared_new\n"
+        _clear_diff_cache()
+        with patch("config_manager.difflib.SequenceMatcher", wraps=difflib.SequenceMatcher) as mock_matcher:
+            hunks = ConfigManager._compute_hunks(current, reference)
+            text = _unified_diff_text("test.g", current, reference)
+        assert mock_matcher.call_count == 1
+        assert hunks[0]["header"] in text
+
+    def test_new_file(self):
+        text = _unified_diff_text("sys/config.g", "", "G28\n")
+        assert text == "--- a/sys/config.g\n+++ b/sys/config.g\n@@ -0,0 +1 @@\n+G28\n"
+
+    def test_identical_is_empty(self):
+        assert _unified_diff_text("sys/config.g", "G28\n", "G28\n") == ""
+
 
 # --- Path conversion ---
 
@@ -260,6 +533,12 @@ class TestRefToPrinterPath:
         assert mgr._ref_to_printer_path("www/index.html") == "0:/www/index.html"
         assert mgr._ref_to_printer_path("sys/config.g") is None
 
+    def test_longest_prefix_wins(self):
+        mgr = self._make_manager()
+        mgr._dir_map = {"sys/": "0:/sys/", "sys/meltingplot/": "1:/meltingplot/"}
+        assert mgr._ref_to_printer_path("sys/meltingplot/a.g") == "1:/meltingplot/a.g"
+        assert mgr._ref_to_printer_path("sys/config.g") == "0:/sys/config.g"
+
 
 # --- Integration: diff + apply hunks round-trip ---
 
@@ -272,7 +551,7 @@ class TestDiffApplyRoundTrip:
         current = "line1\nold_A\nline3\nline4\nold_B\nline6\n"
         reference = "line1\nnew_A\nline3\nline4\nnew_B\nline6\n"
 
-        hunks = ConfigManager._compute_hunks("test.g", current, reference)
+        hunks = ConfigManager._compute_hunks(current, reference)
         assert len(hunks) > 0
 
         result_lines = current.splitlines(keepends=True)
@@ -293,7 +572,7 @@ class TestDiffApplyRoundTrip:
         current = "".join(current_lines)
         reference = "".join(reference_lines)
 
-        hunks = ConfigManager._compute_hunks("test.g", current, reference)
+        hunks = ConfigManager._compute_hunks(current, reference)
         assert len(hunks) >= 2
 
         # Apply only the first hunk
@@ -345,7 +624,7 @@ class TestMultiHunkOffsetAccumulation:
         current = "".join(current_lines)
         reference = "".join(reference_lines)
 
-        hunks = ConfigManager._compute_hunks("test.g", current, reference)
+        hunks = ConfigManager._compute_hunks(current, reference)
         assert len(hunks) >= 3
 
         result_lines = current.splitlines(keepends=True)
@@ -369,7 +648,7 @@ class TestMultiHunkOffsetAccumulation:
         current = "".join(current_lines)
         reference = "".join(reference_lines)
 
-        hunks = ConfigManager._compute_hunks("test.g", current, reference)
+        hunks = ConfigManager._compute_hunks(current, reference)
         assert len(hunks) >= 3
 
         result_lines = current.splitlines(keepends=True)
@@ -396,7 +675,7 @@ class TestMultiHunkOffsetAccumulation:
         current = "".join(current_lines)
         reference = "".join(reference_lines)
 
-        hunks = ConfigManager._compute_hunks("test.g", current, reference)
+        hunks = ConfigManager._compute_hunks(current, reference)
         assert len(hunks) >= 3
 
         result_lines = current.splitlines(keepends=True)
@@ -413,7 +692,7 @@ class TestMultiHunkOffsetAccumulation:
         current = "line1\nline2\nline3\nold_end\n"
         reference = "line1\nline2\nline3\nnew_end\nextra\n"
 
-        hunks = ConfigManager._compute_hunks("test.g", current, reference)
+        hunks = ConfigManager._compute_hunks(current, reference)
         assert len(hunks) >= 1
 
         result_lines = current.splitlines(keepends=True)
@@ -436,7 +715,7 @@ class TestMultiHunkOffsetAccumulation:
         current = "".join(current_lines)
         reference = "".join(reference_lines)
 
-        hunks = ConfigManager._compute_hunks("test.g", current, reference)
+        hunks = ConfigManager._compute_hunks(current, reference)
         assert len(hunks) >= 5  # At least 5 separate hunks
 
         result_lines = current.splitlines(keepends=True)
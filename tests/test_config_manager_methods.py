@@ -1,11 +1,12 @@
 """Tests for ConfigManager class methods — sync, diff, apply, backup, restore."""
 
+import contextlib
 import os
-from unittest.mock import MagicMock, patch, call
+from unittest.mock import ANY, DEFAULT, Mock, patch, call
 
 import pytest
 
-from config_manager import ConfigManager, REFERENCE_DIR, BACKUP_DIR
+from config_manager import ConfigManager, BACKUP_DIR, PrinterFileTooLarge, _diff_cache
 
 
 # --- Fixtures ---
@@ -19,10 +20,27 @@ def printer_fs(tmp_path):
     return root
 
 
+@pytest.fixture(autouse=True)
+def ref_dir(monkeypatch, tmp_path):
+    """Point REFERENCE_DIR at the test's tmp_path."""
+    monkeypatch.setattr("config_manager.REFERENCE_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def ref_repo(ref_dir):
+    """Mark the reference directory as a cloned repository."""
+    (ref_dir / ".git").mkdir()
+    return ref_dir
+
+
 @pytest.fixture
 def mock_dsf():
-    """Create a mock DSF connection (used for non-file operations)."""
-    return MagicMock()
+    """Create an opaque DSF connection handle.
+
+    ConfigManager only stores it, so any attribute access is a test bug.
+    """
+    return Mock(spec=object)
 
 
 @pytest.fixture
@@ -48,6 +66,36 @@ def _write_printer_file(printer_fs, rel_path, content):
     full.write_text(content, encoding="utf-8")
 
 
+def _write_reference_file(ref_dir, rel_path, content):
+    """Helper to create a file in the reference repository."""
+    full = ref_dir / rel_path
+    full.parent.mkdir(parents=True, exist_ok=True)
+    full.write_text(content, encoding="utf-8")
+
+
+@contextlib.contextmanager
+def _patch_sync_git(branch=("3.5", True), branches=("main", "3.5"), **side_effects):
+    """Patch every git call ``sync()`` makes; yields the mocks by name.
+
+    *branch* is what ``find_closest_branch`` returns, *branches* what
+    ``list_remote_branches`` returns; keyword arguments set side effects.
+    """
+    with patch.multiple(
+        "config_manager",
+        clone=DEFAULT,
+        fetch=DEFAULT,
+        find_closest_branch=DEFAULT,
+        checkout=DEFAULT,
+        pull=DEFAULT,
+        list_remote_branches=DEFAULT,
+    ) as mocks:
+        mocks["find_closest_branch"].return_value = branch
+        mocks["list_remote_branches"].return_value = list(branches)
+        for name, side_effect in side_effects.items():
+            mocks[name].side_effect = side_effect
+        yield mocks
+
+
 # --- File I/O ---
 
 
@@ -67,15 +115,87 @@ class TestFileIO:
         result = mgr._read_printer_file("0:/sys/config.g")
         assert result is None
 
+    def test_read_printer_file_normalizes_crlf(self, manager, printer_fs):
+        path = printer_fs / "sys" / "config.g"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"G28\r\nM584\r\n")
+        assert manager._read_printer_file("0:/sys/config.g") == "G28\nM584\n"
+        assert manager._read_printer_bytes("0:/sys/config.g") == b"G28\r\nM584\r\n"
+
+    def test_read_printer_bytes_rejects_oversized_file(self, manager, printer_fs):
+        _write_printer_file(printer_fs, "sys/config.g", "G28\n")
+        with (
+            patch("config_manager.MAX_PRINTER_FILE_SIZE", 2),
+            pytest.raises(PrinterFileTooLarge, match="sys/config.g"),
+        ):
+            manager._read_printer_file("0:/sys/config.g")
+
+    def test_printer_to_fs_path_longest_prefix_wins(self, manager):
+        manager._resolved_dirs = {
+            "0:/sys/": "/sd/sys/",
+            "0:/sys/meltingplot/": "/other/meltingplot/",
+        }
+        assert manager._printer_to_fs_path("0:/sys/meltingplot/a.g") == "/other/meltingplot/a.g"
+        assert manager._printer_to_fs_path("0:/sys/config.g") == "/sd/sys/config.g"
+        assert manager._printer_to_fs_path("0:/gcodes/a.g") is None
+
     def test_write_printer_file_success(self, manager, printer_fs):
         manager._write_printer_file("0:/sys/config.g", "G28\n")
-        written = (printer_fs / "sys" / "config.g").read_text()
-        assert written == "G28\n"
+        written = (printer_fs / "sys" / "config.g").read_bytes()
+        assert written == b"G28\n"
 
     def test_write_printer_file_creates_dirs(self, manager, printer_fs):
         manager._write_printer_file("0:/sys/subdir/config.g", "G28\n")
-        written = (printer_fs / "sys" / "subdir" / "config.g").read_text()
-        assert written == "G28\n"
+        written = (printer_fs / "sys" / "subdir" / "config.g").read_bytes()
+        assert written == b"G28\n"
+
+    def test_write_printer_file_keeps_mode_and_no_temp_left(self, manager, printer_fs):
+        _write_printer_file(printer_fs, "sys/config.g", "old\n")
+        target = printer_fs / "sys" / "config.g"
+        os.chmod(target, 0o640)
+        manager._write_printer_file("0:/sys/config.g", "G28\n")
+        assert target.read_bytes() == b"G28\n"
+        assert (os.stat(target).st_mode & 0o777) == 0o640
+        assert os.listdir(printer_fs / "sys") == ["config.g"]
+
+    def test_write_printer_file_failure_keeps_original(self, manager, printer_fs):
+        _write_printer_file(printer_fs, "sys/config.g", "old\n")
+        with (
+            patch("config_manager.os.replace", side_effect=OSError("disk full")),
+            pytest.raises(OSError),
+        ):
+            manager._write_printer_file("0:/sys/config.g", "G28\n")
+        assert (printer_fs / "sys" / "config.g").read_bytes() == b"old\n"
+        assert os.listdir(printer_fs / "sys") == ["config.g"]
+
+    def test_write_printer_bytes(self, manager, printer_fs):
+        manager._write_printer_bytes("0:/sys/config.g", b"G28\r\n")
+        assert (printer_fs / "sys" / "config.g").read_bytes() == b"G28\r\n"
+
+    def test_write_printer_bytes_fsyncs_file_and_directory(self, manager, printer_fs):
+        with patch("config_manager.os.fsync") as mock_fsync:
+            manager._write_printer_bytes("0:/sys/config.g", b"G28\n")
+        # Once for the data, once for the directory entry
+        assert mock_fsync.call_count == 2
+
+    def test_write_printer_bytes_fsync_opt_out(self, manager, printer_fs):
+        with patch("config_manager.os.fsync") as mock_fsync:
+            manager._write_printer_bytes("0:/sys/config.g", b"G28\n", fsync=False)
+        mock_fsync.assert_not_called()
+        assert (printer_fs / "sys" / "config.g").read_bytes() == b"G28\n"
+
+    def test_write_printer_bytes_keeps_symlink(self, manager, printer_fs, tmp_path):
+        real = tmp_path / "elsewhere" / "config.g"
+        real.parent.mkdir()
+        real.write_bytes(b"old\n")
+        link = printer_fs / "sys" / "config.g"
+        link.parent.mkdir(parents=True, exist_ok=True)
+        link.symlink_to(real)
+
+        manager._write_printer_bytes("0:/sys/config.g", b"G28\n")
+
+        assert link.is_symlink()
+        assert real.read_bytes() == b"G28\n"
 
     def test_write_printer_file_unresolvable_raises(self):
         with patch("config_manager.init_backup_repo"):
@@ -83,16 +203,39 @@ class TestFileIO:
         with pytest.raises(RuntimeError, match="Cannot resolve"):
             mgr._write_printer_file("0:/sys/config.g", "content")
 
-    def test_read_reference_file_success(self, manager, tmp_path):
-        ref_file = tmp_path / "test.g"
+    def test_read_reference_file_success(self, manager, ref_dir):
+        ref_file = ref_dir / "test.g"
         ref_file.write_text("G28\nM584\n", encoding="utf-8")
-        with patch("config_manager.REFERENCE_DIR", str(tmp_path)):
-            result = manager._read_reference_file("test.g")
+        result = manager._read_reference_file("test.g")
         assert result == "G28\nM584\n"
 
-    def test_read_reference_file_not_found(self, manager):
-        with patch("config_manager.REFERENCE_DIR", "/nonexistent"):
-            result = manager._read_reference_file("no_such_file.g")
+    def test_read_reference_file_cached_until_rewritten(self, manager, ref_dir):
+        ref_file = ref_dir / "cached.g"
+        ref_file.write_text("G28\n", encoding="utf-8")
+        real_open = open
+        with patch("builtins.open", side_effect=real_open) as mock_open:
+            assert manager._read_reference_file("cached.g") == "G28\n"
+            assert manager._read_reference_file("cached.g") == "G28\n"
+            assert mock_open.call_count == 1
+
+            ref_file.write_text("G28 X\n", encoding="utf-8")
+            assert manager._read_reference_file("cached.g") == "G28 X\n"
+
+    def test_read_reference_file_large_file_not_cached(self, manager, ref_dir):
+        ref_file = ref_dir / "large.g"
+        ref_file.write_text("G28\n", encoding="utf-8")
+        real_open = open
+        with (
+            patch("config_manager.REFERENCE_CACHE_MAX_FILE_SIZE", 2),
+            patch("builtins.open", side_effect=real_open) as mock_open,
+        ):
+            assert manager._read_reference_file("large.g") == "G28\n"
+            assert manager._read_reference_file("large.g") == "G28\n"
+            assert mock_open.call_count == 2
+
+    def test_read_reference_file_not_found(self, manager, monkeypatch):
+        monkeypatch.setattr("config_manager.REFERENCE_DIR", "/nonexistent")
+        result = manager._read_reference_file("no_such_file.g")
         assert result is None
 
 
@@ -111,127 +254,142 @@ class TestSync:
         assert "error" in result
         assert "firmware version" in result["error"].lower() or "branch override" in result["error"].lower()
 
-    def test_sync_exact_branch_match(self, manager):
-        with (
-            patch("config_manager.clone") as mock_clone,
-            patch("config_manager.fetch") as mock_fetch,
-            patch("config_manager.find_closest_branch", return_value=("3.5.1", True)),
-            patch("config_manager.checkout") as mock_checkout,
-            patch("config_manager.pull") as mock_pull,
-            patch("config_manager.list_remote_branches", return_value=["main", "3.5", "3.5.1"]),
-        ):
-            result = manager.sync("https://example.com/repo.git", "3.5.1")
-
-        mock_clone.assert_called_once_with("https://example.com/repo.git", REFERENCE_DIR)
-        mock_fetch.assert_called_once_with(REFERENCE_DIR)
-        mock_checkout.assert_called_once_with(REFERENCE_DIR, "3.5.1")
-        mock_pull.assert_called_once_with(REFERENCE_DIR)
-        assert result["activeBranch"] == "3.5.1"
-        assert result["exact"] is True
-        assert result["warning"] is None
-        assert "branches" in result
-
-    def test_sync_fallback_branch_has_warning(self, manager):
-        with (
-            patch("config_manager.clone"),
-            patch("config_manager.fetch"),
-            patch("config_manager.find_closest_branch", return_value=("3.5", False)),
-            patch("config_manager.checkout"),
-            patch("config_manager.pull"),
-            patch("config_manager.list_remote_branches", return_value=["main", "3.5"]),
-        ):
-            result = manager.sync("https://example.com/repo.git", "3.5.2")
-
-        assert result["activeBranch"] == "3.5"
-        assert result["exact"] is False
-        assert result["warning"] is not None
-        assert "3.5.2" in result["warning"]
-        assert "3.5" in result["warning"]
+    # (firmware version, branch override, find_closest_branch result)
+    @pytest.mark.parametrize("firmware, override, closest", [
+        ("3.5.1", "", ("3.5.1", True)),
+        ("3.5.2", "", ("3.5", False)),
+        ("3.5.1", "custom", ("custom", True)),
+    ], ids=["exact", "fallback", "override"])
+    def test_sync_checks_out_closest_branch(self, manager, ref_dir, firmware, override, closest):
+        branch, exact = closest
+        with _patch_sync_git(closest, ["main", "3.5", "3.5.1", "custom"]) as mocks:
+            result = manager.sync("https://example.com/repo.git", firmware, branch_override=override)
+
+        target = override or firmware
+        mocks["clone"].assert_called_once_with("https://example.com/repo.git", str(ref_dir))
+        mocks["fetch"].assert_called_once_with(str(ref_dir))
+        # The override, when set, is looked up instead of the firmware version
+        mocks["find_closest_branch"].assert_called_once_with(str(ref_dir), target)
+        mocks["checkout"].assert_called_once_with(str(ref_dir), branch)
+        mocks["pull"].assert_called_once_with(str(ref_dir))
+        assert result == {
+            "activeBranch": branch,
+            "exact": exact,
+            "warning": None if exact else ANY,
+            "branches": ["main", "3.5", "3.5.1", "custom"],
+        }
+        if not exact:
+            assert target in result["warning"]
+            assert branch in result["warning"]
+
+    def test_sync_clears_diff_cache(self, manager, ref_dir):
+        ConfigManager._compute_hunks("G28\n", "M80\n")
+        with _patch_sync_git():
+            manager.sync("https://example.com/repo.git", "3.5")
+        assert not _diff_cache
 
     def test_sync_no_matching_branch(self, manager):
-        with (
-            patch("config_manager.clone"),
-            patch("config_manager.fetch"),
-            patch("config_manager.find_closest_branch", return_value=(None, False)),
-            patch("config_manager.list_remote_branches", return_value=["main"]),
-        ):
+        with _patch_sync_git((None, False), ["main"]) as mocks:
             result = manager.sync("https://example.com/repo.git", "9.9.9")
 
+        mocks["checkout"].assert_not_called()
         assert "error" in result
         assert "branches" in result
 
-    def test_sync_branch_override_takes_precedence(self, manager):
-        with (
-            patch("config_manager.clone"),
-            patch("config_manager.fetch"),
-            patch("config_manager.find_closest_branch", return_value=("custom", True)) as mock_find,
-            patch("config_manager.checkout"),
-            patch("config_manager.pull"),
-            patch("config_manager.list_remote_branches", return_value=["main", "custom"]),
-        ):
-            result = manager.sync("https://example.com/repo.git", "3.5.1", branch_override="custom")
-
-        # find_closest_branch should be called with the override, not firmware version
-        mock_find.assert_called_once_with(REFERENCE_DIR, "custom")
-        assert result["activeBranch"] == "custom"
-
 
 class TestGetBranches:
-    def test_get_branches_when_repo_exists(self, manager, tmp_path):
-        git_dir = tmp_path / ".git"
-        git_dir.mkdir()
-        with (
-            patch("config_manager.REFERENCE_DIR", str(tmp_path)),
-            patch("config_manager.list_remote_branches", return_value=["main", "3.5"]),
-        ):
+    def test_get_branches_when_repo_exists(self, manager, ref_repo):
+        with patch("config_manager.list_remote_branches", return_value=["main", "3.5"]):
             result = manager.get_branches()
         assert result == ["main", "3.5"]
 
-    def test_get_branches_when_repo_not_cloned(self, manager):
-        with patch("config_manager.REFERENCE_DIR", "/nonexistent"):
-            result = manager.get_branches()
+    def test_get_branches_when_repo_not_cloned(self, manager, monkeypatch):
+        monkeypatch.setattr("config_manager.REFERENCE_DIR", "/nonexistent")
+        result = manager.get_branches()
         assert result == []
 
-
-class TestGetActiveBranch:
-    def test_get_active_branch_when_repo_exists(self, manager, tmp_path):
-        git_dir = tmp_path / ".git"
-        git_dir.mkdir()
+    def test_clone_probe_remembered(self, manager, ref_repo):
+        with (
+            patch("config_manager.list_remote_branches", return_value=["main"]),
+            patch("config_manager.os.path.isdir", return_value=True) as mock_isdir,
+        ):
+            manager.get_branches()
+            manager.get_branches()
+        assert mock_isdir.call_count == 1
+
+    def test_clone_probe_rechecked_for_other_dir(self, manager, ref_repo, monkeypatch):
+        with patch("config_manager.list_remote_branches", return_value=["main"]):
+            assert manager.get_branches() == ["main"]
+        monkeypatch.setattr("config_manager.REFERENCE_DIR", "/nonexistent")
+        assert manager.get_branches() == []
+
+
+class TestGetReferenceFiles:
+    def test_not_cloned_returns_empty(self, manager, monkeypatch):
+        monkeypatch.setattr("config_manager.REFERENCE_DIR", "/nonexistent")
+        with patch("config_manager.list_files") as mock_list:
+            assert manager.get_reference_files() == []
+        mock_list.assert_not_called()
+
+    def test_protected_files_hidden(self, manager, ref_repo):
+        files = ["sys/config.g", "sys/meltingplot/dsf-config-override.g"]
+        with patch("config_manager.list_files", return_value=files):
+            assert manager.get_reference_files() == ["sys/config.g"]
+
+    def test_listing_cached_until_sync(self, manager, ref_repo):
         with (
-            patch("config_manager.REFERENCE_DIR", str(tmp_path)),
-            patch("config_manager.current_branch", return_value="3.5"),
+            patch("config_manager.list_files", return_value=["sys/config.g"]) as mock_list,
+            _patch_sync_git(),
         ):
+            manager.get_reference_files()
+            manager.get_reference_files()
+            assert mock_list.call_count == 1
+
+            manager.sync("https://example.com/repo.git", "3.5")
+            manager.get_reference_files()
+            assert mock_list.call_count == 2
+
+
+class TestGetActiveBranch:
+    def test_get_active_branch_when_repo_exists(self, manager, ref_repo):
+        with patch("config_manager.current_branch", return_value="3.5"):
             result = manager.get_active_branch()
         assert result == "3.5"
 
-    def test_get_active_branch_when_repo_not_cloned(self, manager):
-        with patch("config_manager.REFERENCE_DIR", "/nonexistent"):
-            result = manager.get_active_branch()
+    def test_get_active_branch_when_repo_not_cloned(self, manager, monkeypatch):
+        monkeypatch.setattr("config_manager.REFERENCE_DIR", "/nonexistent")
+        result = manager.get_active_branch()
         assert result == ""
 
+    def test_get_active_branch_cached_and_set_by_sync(self, manager, ref_repo):
+        with (
+            patch("config_manager.current_branch", return_value="3.5") as mock_current,
+            _patch_sync_git(("3.6", True), ["3.5", "3.6"]),
+        ):
+            assert manager.get_active_branch() == "3.5"
+            assert manager.get_active_branch() == "3.5"
+            assert mock_current.call_count == 1
+
+            manager.sync("https://example.com/repo.git", "3.6")
+            assert manager.get_active_branch() == "3.6"
+            assert mock_current.call_count == 1
+
 
 # --- Diffing ---
 
 
 class TestDiffAll:
-    def test_diff_all_repo_not_cloned(self, manager):
-        with patch("config_manager.REFERENCE_DIR", "/nonexistent"):
-            result = manager.diff_all()
+    def test_diff_all_repo_not_cloned(self, manager, monkeypatch):
+        monkeypatch.setattr("config_manager.REFERENCE_DIR", "/nonexistent")
+        result = manager.diff_all()
         assert result == []
 
-    def test_diff_all_unchanged_file(self, manager, printer_fs, tmp_path):
-        git_dir = tmp_path / ".git"
-        git_dir.mkdir()
-        sys_dir = tmp_path / "sys"
-        sys_dir.mkdir()
-        (sys_dir / "config.g").write_text("G28\n", encoding="utf-8")
+    def test_diff_all_unchanged_file(self, manager, printer_fs, ref_repo):
+        _write_reference_file(ref_repo, "sys/config.g", "G28\n")
 
         _write_printer_file(printer_fs, "sys/config.g", "G28\n")
 
-        with (
-            patch("config_manager.REFERENCE_DIR", str(tmp_path)),
-            patch("config_manager.list_files", return_value=["sys/config.g"]),
-        ):
+        with patch("config_manager.list_files", return_value=["sys/config.g"]):
             result = manager.diff_all()
 
         assert len(result) == 1
@@ -239,20 +397,39 @@ class TestDiffAll:
         assert result[0]["file"] == "sys/config.g"
         assert result[0]["printerPath"] == "0:/sys/config.g"
 
-    def test_diff_all_missing_file(self, manager, tmp_path):
-        git_dir = tmp_path / ".git"
-        git_dir.mkdir()
-        sys_dir = tmp_path / "sys"
-        sys_dir.mkdir()
-        (sys_dir / "config.g").write_text("G28\n", encoding="utf-8")
+    def test_diff_all_identical_bytes_skip_text_read(self, manager, printer_fs, ref_repo):
+        _write_reference_file(ref_repo, "sys/config.g", "G28\n")
+
+        _write_printer_file(printer_fs, "sys/config.g", "G28\n")
 
-        # No printer file created -> missing
         with (
-            patch("config_manager.REFERENCE_DIR", str(tmp_path)),
             patch("config_manager.list_files", return_value=["sys/config.g"]),
+            patch.object(manager, "_read_printer_file") as mock_read,
         ):
             result = manager.diff_all()
 
+        mock_read.assert_not_called()
+        assert result[0]["status"] == "unchanged"
+        assert result[0]["hunks"] == []
+
+    def test_diff_all_line_ending_only_change_is_unchanged(self, manager, printer_fs, ref_repo):
+        """Different bytes but equal text (CRLF vs LF) still reports unchanged."""
+        (ref_repo / "sys").mkdir()
+        (ref_repo / "sys" / "config.g").write_bytes(b"G28\r\n")
+        _write_printer_file(printer_fs, "sys/config.g", "G28\n")
+
+        with patch("config_manager.list_files", return_value=["sys/config.g"]):
+            result = manager.diff_all()
+
+        assert result[0]["status"] == "unchanged"
+
+    def test_diff_all_missing_file(self, manager, ref_repo):
+        _write_reference_file(ref_repo, "sys/config.g", "G28\n")
+
+        # No printer file created -> missing
+        with patch("config_manager.list_files", return_value=["sys/config.g"]):
+            result = manager.diff_all()
+
         assert len(result) == 1
         assert result[0]["status"] == "missing"
         # Missing files now include summary hunks (index + header, no lines)
@@ -262,76 +439,96 @@ class TestDiffAll:
             assert "header" in hunk
             assert "lines" not in hunk
 
-    def test_diff_all_modified_file(self, manager, printer_fs, tmp_path):
-        git_dir = tmp_path / ".git"
-        git_dir.mkdir()
-        sys_dir = tmp_path / "sys"
-        sys_dir.mkdir()
-        (sys_dir / "config.g").write_text("G28\nnew_line\n", encoding="utf-8")
+    def test_diff_all_modified_file(self, manager, printer_fs, ref_repo):
+        _write_reference_file(ref_repo, "sys/config.g", "G28\nnew_line\n")
 
         _write_printer_file(printer_fs, "sys/config.g", "G28\nold_line\n")
 
-        with (
-            patch("config_manager.REFERENCE_DIR", str(tmp_path)),
-            patch("config_manager.list_files", return_value=["sys/config.g"]),
-        ):
+        with patch("config_manager.list_files", return_value=["sys/config.g"]):
             result = manager.diff_all()
 
         assert len(result) == 1
         assert result[0]["status"] == "modified"
         assert len(result[0]["hunks"]) > 0
 
-    def test_diff_all_skips_unmanaged_paths(self, manager, tmp_path):
-        git_dir = tmp_path / ".git"
-        git_dir.mkdir()
+    def test_diff_all_skips_unmanaged_paths(self, manager, ref_repo):
 
-        with (
-            patch("config_manager.REFERENCE_DIR", str(tmp_path)),
-            patch("config_manager.list_files", return_value=["README.md", "unknown/file.txt"]),
-        ):
+        with patch("config_manager.list_files", return_value=["README.md", "unknown/file.txt"]):
             result = manager.diff_all()
 
         assert result == []
 
-    def test_diff_all_mixed_statuses(self, manager, printer_fs, tmp_path):
-        git_dir = tmp_path / ".git"
-        git_dir.mkdir()
-        sys_dir = tmp_path / "sys"
-        sys_dir.mkdir()
-        (sys_dir / "config.g").write_text("G28\n", encoding="utf-8")
-        (sys_dir / "homex.g").write_text("G28 X\n", encoding="utf-8")
+    def test_diff_all_mixed_statuses(self, manager, printer_fs, ref_repo):
+        _write_reference_file(ref_repo, "sys/config.g", "G28\n")
+        _write_reference_file(ref_repo, "sys/homex.g", "G28 X\n")
 
         # config.g exists on printer with matching content; homex.g does not
         _write_printer_file(printer_fs, "sys/config.g", "G28\n")
 
-        with (
-            patch("config_manager.REFERENCE_DIR", str(tmp_path)),
-            patch("config_manager.list_files", return_value=["sys/config.g", "sys/homex.g"]),
-        ):
+        with patch("config_manager.list_files", return_value=["sys/config.g", "sys/homex.g"]):
             result = manager.diff_all()
 
         statuses = {r["file"]: r["status"] for r in result}
         assert statuses["sys/config.g"] == "unchanged"
         assert statuses["sys/homex.g"] == "missing"
 
+    def test_diff_all_many_files_keeps_order(self, manager, printer_fs, ref_repo):
+        names = [f"sys/file{i}.g" for i in range(10)]
+        for i, name in enumerate(names):
+            _write_reference_file(ref_repo, name, f"G28\nM{i}\n")
+            if i % 3 == 0:
+                _write_printer_file(printer_fs, name, f"G28\nM{i}\n")
+            elif i % 3 == 1:
+                _write_printer_file(printer_fs, name, "G28\n")
+
+        with patch("config_manager.list_files", return_value=names + ["README.md"]):
+            result = manager.diff_all()
+
+        assert [r["file"] for r in result] == names
+        assert [r["status"] for r in result] == [
+            ("unchanged", "modified", "missing")[i % 3] for i in range(10)
+        ]
+
+    def test_diff_all_oversized_printer_file(self, manager, printer_fs, ref_repo):
+        _write_reference_file(ref_repo, "sys/config.g", "G28\n")
+        _write_printer_file(printer_fs, "sys/config.g", "G28\nM80\n")
+
+        with (
+            patch("config_manager.list_files", return_value=["sys/config.g"]),
+            patch("config_manager.MAX_PRINTER_FILE_SIZE", 2),
+        ):
+            result = manager.diff_all()
+
+        assert result[0]["status"] == "too_large"
+        assert result[0]["hunks"] == []
+
+    def test_file_listing_reused_until_sync(self, manager, ref_repo):
+        with (
+            patch("config_manager.list_files", return_value=[]) as mock_list,
+            _patch_sync_git(),
+        ):
+            manager.diff_all()
+            manager.diff_all()
+            assert mock_list.call_count == 1
+
+            manager.sync("https://example.com/repo.git", "3.5")
+            manager.diff_all()
+            assert mock_list.call_count == 2
+
 
 class TestDiffFile:
     def test_diff_file_unknown_path(self, manager):
         result = manager.diff_file("unknown/file.g")
         assert "error" in result
 
-    def test_diff_file_not_in_reference(self, manager, tmp_path):
-        with patch("config_manager.REFERENCE_DIR", str(tmp_path)):
-            result = manager.diff_file("sys/nonexistent.g")
+    def test_diff_file_not_in_reference(self, manager):
+        result = manager.diff_file("sys/nonexistent.g")
         assert result["status"] == "not_in_reference"
 
-    def test_diff_file_missing_on_printer(self, manager, tmp_path):
-        sys_dir = tmp_path / "sys"
-        sys_dir.mkdir()
-        (sys_dir / "config.g").write_text("G28\n", encoding="utf-8")
+    def test_diff_file_missing_on_printer(self, manager, ref_dir):
+        _write_reference_file(ref_dir, "sys/config.g", "G28\n")
 
-        with patch("config_manager.REFERENCE_DIR", str(tmp_path)):
-            result = manager.diff_file("sys/config.g")
+        result = manager.diff_file("sys/config.g")
 
         assert result["status"] == "missing"
         # New files should show the full content as additions
@@ -343,15 +540,22 @@ class TestDiffFile:
             for line in hunk["lines"]:
                 assert line.startswith("+"), f"Expected all lines to be additions, got: {line}"
 
-    def test_diff_file_missing_multiline(self, manager, tmp_path):
-        """Missing file with multiple lines shows all content as additions."""
-        sys_dir = tmp_path / "sys"
-        sys_dir.mkdir()
-        (sys_dir / "config.g").write_text("G28\nM584 X0 Y1\nM906 X800 Y800\n", encoding="utf-8")
+    def test_diff_file_oversized_printer_file(self, manager, printer_fs, ref_dir):
+        _write_reference_file(ref_dir, "sys/config.g", "G28\n")
+        _write_printer_file(printer_fs, "sys/config.g", "G28\nM80\n")
 
-        with patch("config_manager.REFERENCE_DIR", str(tmp_path)):
+        with patch("config_manager.MAX_PRINTER_FILE_SIZE", 2):
             result = manager.diff_file("sys/config.g")
 
+        assert result["status"] == "too_large"
+        assert result["hunks"] == []
+
+    def test_diff_file_missing_multiline(self, manager, ref_dir):
+        """Missing file with multiple lines shows all content as additions."""
+        _write_reference_file(ref_dir, "sys/config.g", "G28\nM584 X0 Y1\nM906 X800 Y800\n")
+
+        result = manager.diff_file("sys/config.g")
+
         assert result["status"] == "missing"
         assert len(result["hunks"]) > 0
         # Unified diff should contain all reference lines
@@ -359,26 +563,20 @@ class TestDiffFile:
         assert "M584" in result["unifiedDiff"]
         assert "M906" in result["unifiedDiff"]
 
-    def test_diff_file_unchanged(self, manager, printer_fs, tmp_path):
-        sys_dir = tmp_path / "sys"
-        sys_dir.mkdir()
-        (sys_dir / "config.g").write_text("G28\n", encoding="utf-8")
+    def test_diff_file_unchanged(self, manager, printer_fs, ref_dir):
+        _write_reference_file(ref_dir, "sys/config.g", "G28\n")
         _write_printer_file(printer_fs, "sys/config.g", "G28\n")
 
-        with patch("config_manager.REFERENCE_DIR", str(tmp_path)):
-            result = manager.diff_file("sys/config.g")
+        result = manager.diff_file("sys/config.g")
 
         assert result["status"] == "unchanged"
         assert result["hunks"] == []
 
-    def test_diff_file_modified(self, manager, printer_fs, tmp_path):
-        sys_dir = tmp_path / "sys"
-        sys_dir.mkdir()
-        (sys_dir / "config.g").write_text("G28\nnew_line\n", encoding="utf-8")
+    def test_diff_file_modified(self, manager, printer_fs, ref_dir):
+        _write_reference_file(ref_dir, "sys/config.g", "G28\nnew_line\n")
         _write_printer_file(printer_fs, "sys/config.g", "G28\nold_line\n")
 
-        with patch("config_manager.REFERENCE_DIR", str(tmp_path)):
-            result = manager.diff_file("sys/config.g")
+        result = manager.diff_file("sys/config.g")
 
         assert result["status"] == "modified"
         assert len(result["hunks"]) > 0
@@ -391,21 +589,16 @@ class TestDiffFile:
 
 
 class TestApplyAll:
-    def test_apply_all_repo_not_cloned(self, manager):
-        with patch("config_manager.REFERENCE_DIR", "/nonexistent"):
-            result = manager.apply_all()
+    def test_apply_all_repo_not_cloned(self, manager, monkeypatch):
+        monkeypatch.setattr("config_manager.REFERENCE_DIR", "/nonexistent")
+        result = manager.apply_all()
         assert "error" in result
 
-    def test_apply_all_writes_all_managed_files(self, manager, printer_fs, tmp_path):
-        git_dir = tmp_path / ".git"
-        git_dir.mkdir()
-        sys_dir = tmp_path / "sys"
-        sys_dir.mkdir()
-        (sys_dir / "config.g").write_text("G28\n", encoding="utf-8")
-        (sys_dir / "homex.g").write_text("G28 X\n", encoding="utf-8")
+    def test_apply_all_writes_all_managed_files(self, manager, printer_fs, ref_repo):
+        _write_reference_file(ref_repo, "sys/config.g", "G28\n")
+        _write_reference_file(ref_repo, "sys/homex.g", "G28 X\n")
 
         with (
-            patch("config_manager.REFERENCE_DIR", str(tmp_path)),
             patch("config_manager.list_files", return_value=["sys/config.g", "sys/homex.g"]),
             patch.object(manager, "_create_backup"),
             patch.object(manager, "get_active_branch", return_value="3.5"),
@@ -415,15 +608,28 @@ class TestApplyAll:
         assert "applied" in result
         assert "sys/config.g" in result["applied"]
         assert "sys/homex.g" in result["applied"]
-        assert (printer_fs / "sys" / "config.g").read_text() == "G28\n"
-        assert (printer_fs / "sys" / "homex.g").read_text() == "G28 X\n"
+        assert (printer_fs / "sys" / "config.g").read_bytes() == b"G28\n"
+        assert (printer_fs / "sys" / "homex.g").read_bytes() == b"G28 X\n"
+
+    def test_apply_all_many_files_keeps_order(self, manager, printer_fs, ref_repo):
+        names = [f"sys/file{i}.g" for i in range(10)]
+        for i, name in enumerate(names):
+            _write_reference_file(ref_repo, name, f"M{i}\n")
+
+        with (
+            patch("config_manager.list_files", return_value=names + ["sys/missing.g"]),
+            patch.object(manager, "_create_backup"),
+            patch.object(manager, "get_active_branch", return_value="3.5"),
+        ):
+            result = manager.apply_all()
+
+        assert result["applied"] == names
+        for i, name in enumerate(names):
+            assert (printer_fs / name).read_bytes() == f"M{i}\n".encode()
 
-    def test_apply_all_skips_unmanaged_files(self, manager, printer_fs, tmp_path):
-        git_dir = tmp_path / ".git"
-        git_dir.mkdir()
+    def test_apply_all_skips_unmanaged_files(self, manager, printer_fs, ref_repo):
 
         with (
-            patch("config_manager.REFERENCE_DIR", str(tmp_path)),
             patch("config_manager.list_files", return_value=["README.md"]),
             patch.object(manager, "_create_backup"),
             patch.object(manager, "get_active_branch", return_value="main"),
@@ -434,12 +640,9 @@ class TestApplyAll:
         # No files written to printer fs
         assert not (printer_fs / "sys").exists()
 
-    def test_apply_all_creates_backups(self, manager, tmp_path):
-        git_dir = tmp_path / ".git"
-        git_dir.mkdir()
+    def test_apply_all_creates_backups(self, manager, ref_repo):
 
         with (
-            patch("config_manager.REFERENCE_DIR", str(tmp_path)),
             patch("config_manager.list_files", return_value=[]),
             patch.object(manager, "_create_backup") as mock_backup,
             patch.object(manager, "get_active_branch", return_value="main"),
@@ -456,35 +659,24 @@ class TestApplyFile:
         result = manager.apply_file("unknown/file.g")
         assert "error" in result
 
-    def test_apply_file_not_in_reference(self, manager, tmp_path):
-        with patch("config_manager.REFERENCE_DIR", str(tmp_path)):
-            result = manager.apply_file("sys/nonexistent.g")
+    def test_apply_file_not_in_reference(self, manager):
+        result = manager.apply_file("sys/nonexistent.g")
         assert "error" in result
         assert "not found" in result["error"].lower()
 
-    def test_apply_file_success(self, manager, printer_fs, tmp_path):
-        sys_dir = tmp_path / "sys"
-        sys_dir.mkdir()
-        (sys_dir / "config.g").write_text("G28\nnew\n", encoding="utf-8")
+    def test_apply_file_success(self, manager, printer_fs, ref_dir):
+        _write_reference_file(ref_dir, "sys/config.g", "G28\nnew\n")
 
-        with (
-            patch("config_manager.REFERENCE_DIR", str(tmp_path)),
-            patch.object(manager, "_create_backup"),
-        ):
+        with patch.object(manager, "_create_backup"):
             result = manager.apply_file("sys/config.g")
 
         assert result == {"applied": ["sys/config.g"]}
-        assert (printer_fs / "sys" / "config.g").read_text() == "G28\nnew\n"
+        assert (printer_fs / "sys" / "config.g").read_bytes() == b"G28\nnew\n"
 
-    def test_apply_file_creates_backups(self, manager, printer_fs, tmp_path):
-        sys_dir = tmp_path / "sys"
-        sys_dir.mkdir()
-        (sys_dir / "config.g").write_text("G28\n", encoding="utf-8")
+    def test_apply_file_creates_backups(self, manager, printer_fs, ref_dir):
+        _write_reference_file(ref_dir, "sys/config.g", "G28\n")
 
-        with (
-            patch("config_manager.REFERENCE_DIR", str(tmp_path)),
-            patch.object(manager, "_create_backup") as mock_backup,
-        ):
+        with patch.object(manager, "_create_backup") as mock_backup:
             manager.apply_file("sys/config.g")
 
         assert mock_backup.call_count == 2
@@ -495,53 +687,49 @@ class TestApplyHunks:
         result = manager.apply_hunks("unknown/file.g", [0])
         assert "error" in result
 
-    def test_apply_hunks_reference_not_found(self, manager, tmp_path):
-        with patch("config_manager.REFERENCE_DIR", str(tmp_path)):
-            result = manager.apply_hunks("sys/nonexistent.g", [0])
+    def test_apply_hunks_reference_not_found(self, manager):
+        result = manager.apply_hunks("sys/nonexistent.g", [0])
         assert "error" in result
 
-    def test_apply_hunks_printer_file_not_found(self, manager, tmp_path):
-        sys_dir = tmp_path / "sys"
-        sys_dir.mkdir()
-        (sys_dir / "config.g").write_text("G28\n", encoding="utf-8")
+    def test_apply_hunks_printer_file_not_found(self, manager, ref_dir):
+        _write_reference_file(ref_dir, "sys/config.g", "G28\n")
 
         # No printer file -> error
-        with patch("config_manager.REFERENCE_DIR", str(tmp_path)):
-            result = manager.apply_hunks("sys/config.g", [0])
+        result = manager.apply_hunks("sys/config.g", [0])
         assert "error" in result
 
-    def test_apply_hunks_no_valid_hunks(self, manager, printer_fs, tmp_path):
-        sys_dir = tmp_path / "sys"
-        sys_dir.mkdir()
-        (sys_dir / "config.g").write_text("G28\nnew\n", encoding="utf-8")
+    def test_apply_hunks_oversized_printer_file(self, manager, printer_fs, ref_dir):
+        _write_reference_file(ref_dir, "sys/config.g", "G28\n")
+        _write_printer_file(printer_fs, "sys/config.g", "G28\nM80\n")
+
+        with patch("config_manager.MAX_PRINTER_FILE_SIZE", 2):
+            result = manager.apply_hunks("sys/config.g", [0])
+
+        assert "too large" in result["error"]
+        assert (printer_fs / "sys" / "config.g").read_text() == "G28\nM80\n"
+
+    def test_apply_hunks_no_valid_hunks(self, manager, printer_fs, ref_dir):
+        _write_reference_file(ref_dir, "sys/config.g", "G28\nnew\n")
         _write_printer_file(printer_fs, "sys/config.g", "G28\nold\n")
 
-        with patch("config_manager.REFERENCE_DIR", str(tmp_path)):
-            result = manager.apply_hunks("sys/config.g", [999])
+        result = manager.apply_hunks("sys/config.g", [999])
         assert "error" in result
 
-    def test_apply_hunks_success(self, manager, printer_fs, tmp_path):
-        sys_dir = tmp_path / "sys"
-        sys_dir.mkdir()
-        (sys_dir / "config.g").write_text("G28\nnew_line\n", encoding="utf-8")
+    def test_apply_hunks_success(self, manager, printer_fs, ref_dir):
+        _write_reference_file(ref_dir, "sys/config.g", "G28\nnew_line\n")
         _write_printer_file(printer_fs, "sys/config.g", "G28\nold_line\n")
 
-        with (
-            patch("config_manager.REFERENCE_DIR", str(tmp_path)),
-            patch.object(manager, "_create_backup"),
-        ):
+        with patch.object(manager, "_create_backup"):
             result = manager.apply_hunks("sys/config.g", [0])
 
         assert 0 in result["applied"]
         assert result["failed"] == []
         # Verify the written content has the new line
-        written = (printer_fs / "sys" / "config.g").read_text()
-        assert "new_line" in written
+        written = (printer_fs / "sys" / "config.g").read_bytes()
+        assert b"new_line" in written
 
-    def test_apply_hunks_partial_failure(self, manager, printer_fs, tmp_path):
+    def test_apply_hunks_partial_failure(self, manager, printer_fs, ref_dir):
         """Test that when one hunk fails context match, it's reported as failed."""
-        from config_manager import _apply_single_hunk as real_apply
-
         current_lines = [f"line{i}\n" for i in range(30)]
         reference_lines = list(current_lines)
         reference_lines[2] = "CHANGED_A\n"
@@ -549,40 +737,25 @@ class TestApplyHunks:
         current_content = "".join(current_lines)
         reference_content = "".join(reference_lines)
 
-        sys_dir = tmp_path / "sys"
-        sys_dir.mkdir()
-        (sys_dir / "config.g").write_text(reference_content, encoding="utf-8")
+        _write_reference_file(ref_dir, "sys/config.g", reference_content)
         _write_printer_file(printer_fs, "sys/config.g", current_content)
 
-        call_count = 0
-
-        def apply_first_fail_second(lines, hunk, offset):
-            nonlocal call_count
-            call_count += 1
-            if call_count == 2:
-                return False, lines, offset
-            return real_apply(lines, hunk, offset)
-
+        # First hunk's context matches, the second one's does not.
         with (
-            patch("config_manager.REFERENCE_DIR", str(tmp_path)),
             patch.object(manager, "_create_backup"),
-            patch("config_manager._apply_single_hunk", side_effect=apply_first_fail_second),
+            patch("config_manager._match_context", side_effect=[True, False]),
         ):
             result = manager.apply_hunks("sys/config.g", [0, 1])
 
-        assert 0 in result["applied"]
-        assert 1 in result["failed"]
+        assert result["applied"] == [0]
+        assert result["failed"] == [1]
+        assert (printer_fs / "sys" / "config.g").read_bytes().count(b"CHANGED_A") == 1
 
-    def test_apply_hunks_creates_backups(self, manager, printer_fs, tmp_path):
-        sys_dir = tmp_path / "sys"
-        sys_dir.mkdir()
-        (sys_dir / "config.g").write_text("G28\nnew\n", encoding="utf-8")
+    def test_apply_hunks_creates_backups(self, manager, printer_fs, ref_dir):
+        _write_reference_file(ref_dir, "sys/config.g", "G28\nnew\n")
         _write_printer_file(printer_fs, "sys/config.g", "G28\nold\n")
 
-        with (
-            patch("config_manager.REFERENCE_DIR", str(tmp_path)),
-            patch.object(manager, "_create_backup") as mock_backup,
-        ):
+        with patch.object(manager, "_create_backup") as mock_backup:
             manager.apply_hunks("sys/config.g", [0])
 
         assert mock_backup.call_count == 2
@@ -692,34 +865,20 @@ class TestSyncCascadingFailures:
 
     def test_fetch_raises_after_successful_clone(self, manager):
         """Fetch failure is caught and returned as a network error dict."""
-        with (
-            patch("config_manager.clone") as mock_clone,
-            patch("config_manager.fetch", side_effect=RuntimeError("network error")),
-        ):
+        with _patch_sync_git(fetch=RuntimeError("network error")) as mocks:
             result = manager.sync("https://example.com/repo.git", "3.5")
-        mock_clone.assert_called_once()
+        mocks["clone"].assert_called_once()
         assert "error" in result
         assert result.get("networkError") is True
 
     def test_checkout_raises_after_successful_fetch(self, manager):
-        with (
-            patch("config_manager.clone"),
-            patch("config_manager.fetch"),
-            patch("config_manager.find_closest_branch", return_value=("3.5", True)),
-            patch("config_manager.checkout", side_effect=RuntimeError("checkout failed")),
-        ):
+        with _patch_sync_git(checkout=RuntimeError("checkout failed")):
             with pytest.raises(RuntimeError, match="checkout failed"):
                 manager.sync("https://example.com/repo.git", "3.5")
 
     def test_pull_raises_after_successful_checkout(self, manager):
         """Pull failure is caught and returned as a network error dict."""
-        with (
-            patch("config_manager.clone"),
-            patch("config_manager.fetch"),
-            patch("config_manager.find_closest_branch", return_value=("3.5", True)),
-            patch("config_manager.checkout"),
-            patch("config_manager.pull", side_effect=RuntimeError("pull failed")),
-        ):
+        with _patch_sync_git(pull=RuntimeError("pull failed")):
             result = manager.sync("https://example.com/repo.git", "3.5")
         assert "error" in result
         assert result.get("networkError") is True
@@ -731,14 +890,10 @@ class TestSyncCascadingFailures:
 class TestApplyAllPartialWriteFailure:
     """Tests for apply_all when _write_printer_file raises mid-loop."""
 
-    def test_apply_all_write_raises_propagates(self, manager, printer_fs, tmp_path):
+    def test_apply_all_write_raises_propagates(self, manager, printer_fs, ref_repo):
         """If _write_printer_file raises on one file, the exception propagates."""
-        git_dir = tmp_path / ".git"
-        git_dir.mkdir()
-        sys_dir = tmp_path / "sys"
-        sys_dir.mkdir()
-        (sys_dir / "config.g").write_text("content1", encoding="utf-8")
-        (sys_dir / "homex.g").write_text("content2", encoding="utf-8")
+        _write_reference_file(ref_repo, "sys/config.g", "content1")
+        _write_reference_file(ref_repo, "sys/homex.g", "content2")
 
         call_count = 0
         original_write = manager._write_printer_file
@@ -751,7 +906,6 @@ class TestApplyAllPartialWriteFailure:
             return original_write(printer_path, content)
 
         with (
-            patch("config_manager.REFERENCE_DIR", str(tmp_path)),
             patch("config_manager.list_files", return_value=["sys/config.g", "sys/homex.g"]),
             patch.object(manager, "_create_backup"),
             patch.object(manager, "get_active_branch", return_value="3.5"),
@@ -760,13 +914,38 @@ class TestApplyAllPartialWriteFailure:
             with pytest.raises(IOError, match="disk full"):
                 manager.apply_all()
 
-    def test_apply_all_skips_files_with_none_content(self, manager, printer_fs, tmp_path):
+    def test_apply_all_stops_at_first_failed_write(self, manager, printer_fs, ref_repo):
+        """A failed write leaves the remaining printer files untouched."""
+        names = [f"sys/file{i}.g" for i in range(8)]
+        for name in names:
+            _write_reference_file(ref_repo, name, "new\n")
+            _write_printer_file(printer_fs, name, "old\n")
+
+        original_write = manager._write_printer_file
+
+        def write_fail_on_first(printer_path, content):
+            if printer_path == "0:/sys/file0.g":
+                raise IOError("disk full")
+            return original_write(printer_path, content)
+
+        with (
+            patch("config_manager.list_files", return_value=names),
+            patch.object(manager, "_create_backup") as mock_backup,
+            patch.object(manager, "get_active_branch", return_value="3.5"),
+            patch.object(manager, "_write_printer_file", side_effect=write_fail_on_first),
+        ):
+            with pytest.raises(IOError, match="disk full"):
+                manager.apply_all()
+
+        for name in names:
+            assert (printer_fs / name).read_text() == "old\n"
+        # Only the pre-update backup was taken
+        mock_backup.assert_called_once_with("Pre-update backup")
+
+    def test_apply_all_skips_files_with_none_content(self, manager, printer_fs, ref_repo):
         """Files where _read_reference_file returns None are skipped, not applied."""
-        git_dir = tmp_path / ".git"
-        git_dir.mkdir()
 
         with (
-            patch("config_manager.REFERENCE_DIR", str(tmp_path)),
             patch("config_manager.list_files", return_value=["sys/config.g"]),
             patch.object(manager, "_read_reference_file", return_value=None),
             patch.object(manager, "_create_backup"),
@@ -1,112 +1,107 @@
 """Tests for meltingplot-config-daemon.py — handlers and response helpers."""
 
-import importlib
 import json
 import sys
-import types
 from types import SimpleNamespace
-from unittest.mock import MagicMock
+from unittest.mock import Mock
 
 import pytest
 
-# The daemon imports dsf.* which isn't available in test. We need to mock
-# those modules before importing the daemon.
-
-
-@pytest.fixture(autouse=True)
-def mock_dsf_modules(monkeypatch):
-    """Mock the dsf library modules so the daemon can be imported."""
-    dsf_mod = types.ModuleType("dsf")
-    dsf_connections = types.ModuleType("dsf.connections")
-    dsf_commands = types.ModuleType("dsf.commands")
-    dsf_commands_code = types.ModuleType("dsf.commands.code")
-    dsf_http = types.ModuleType("dsf.http")
-    dsf_object_model = types.ModuleType("dsf.object_model")
-
-    dsf_connections.CommandConnection = MagicMock
-    dsf_connections.InterceptConnection = MagicMock
-    dsf_commands_code.CodeResult = MagicMock
-
-    class FakeHttpEndpointType:
-        GET = "GET"
-        POST = "POST"
-
-    class FakeHttpResponseType:
-        StatusCode = "StatusCode"
-        PlainText = "PlainText"
-        JSON = "JSON"
-        File = "File"
-        URI = "URI"
-
-    dsf_http.HttpEndpointConnection = MagicMock
-    dsf_http.HttpResponseType = FakeHttpResponseType
-    dsf_object_model.HttpEndpointType = FakeHttpEndpointType
-
-    monkeypatch.setitem(sys.modules, "dsf", dsf_mod)
-    monkeypatch.setitem(sys.modules, "dsf.connections", dsf_connections)
-    monkeypatch.setitem(sys.modules, "dsf.commands", dsf_commands)
-    monkeypatch.setitem(sys.modules, "dsf.commands.code", dsf_commands_code)
-    monkeypatch.setitem(sys.modules, "dsf.http", dsf_http)
-    monkeypatch.setitem(sys.modules, "dsf.object_model", dsf_object_model)
-
-
-def _import_daemon():
-    """Import (or reimport) the daemon module."""
-    import importlib.util
-    import os
-
-    spec = importlib.util.spec_from_file_location(
-        "daemon_mod",
-        os.path.join(os.path.dirname(__file__), "..", "dsf", "meltingplot-config-daemon.py"),
-    )
-    mod = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(mod)
-    return mod
+# Object model with synced plugin data.  Shared between tests: handlers
+# read it through get_plugin_data(), which returns a copy.
+_OBJECT_MODEL = SimpleNamespace(
+    plugins={"MeltingplotConfig": SimpleNamespace(data={
+        "status": "up_to_date",
+        "detectedFirmwareVersion": "3.5",
+        "activeBranch": "3.5",
+        "referenceRepoUrl": "https://example.com",
+        "lastSyncTimestamp": "2026-01-01T00:00:00",
+    })}
+)
+
+
+@pytest.fixture
+def cmd():
+    """A stand-in for the DSF command connection."""
+    return Mock()
+
+
+@pytest.fixture
+def manager():
+    """A stand-in ConfigManager; tests set return values per call."""
+    return Mock()
 
 
 class TestResponseHelpers:
-    def test_json_response(self):
-        daemon = _import_daemon()
-        resp = daemon.json_response({"key": "value"})
-        assert resp["status"] == 200
+    @pytest.mark.parametrize("kwargs, status", [({}, 200), ({"status": 201}, 201)])
+    def test_json_response(self, daemon, kwargs, status):
+        resp = daemon.json_response({"key": "value"}, **kwargs)
+        assert resp["status"] == status
         assert resp["contentType"] == "application/json"
         body = json.loads(resp["body"])
         assert body["key"] == "value"
 
-    def test_json_response_custom_status(self):
-        daemon = _import_daemon()
-        resp = daemon.json_response({"ok": True}, status=201)
-        assert resp["status"] == 201
-
-    def test_error_response(self):
-        daemon = _import_daemon()
-        resp = daemon.error_response("something failed")
-        assert resp["status"] == 400
+    @pytest.mark.parametrize("kwargs, status", [({}, 400), ({"status": 404}, 404)])
+    def test_error_response(self, daemon, kwargs, status):
+        resp = daemon.error_response("something failed", **kwargs)
+        assert resp["status"] == status
         body = json.loads(resp["body"])
         assert body["error"] == "something failed"
 
-    def test_error_response_custom_status(self):
-        daemon = _import_daemon()
-        resp = daemon.error_response("not found", status=404)
-        assert resp["status"] == 404
+    def test_json_helpers_fall_back_to_stdlib(self, import_daemon, monkeypatch):
+        # A None entry in sys.modules makes "import orjson" raise ImportError
+        monkeypatch.setitem(sys.modules, "orjson", None)
+        daemon = import_daemon()
+        resp = daemon.json_response({"key": "value"})
+        assert json.loads(resp["body"]) == {"key": "value"}
+        assert daemon._loads('{"hunks": [0]}') == {"hunks": [0]}
+
+
+# Bodies shaped like the handlers' responses, including non-ASCII paths.
+_JSON_PAYLOADS = [
+    {"key": "value"},
+    {"error": "Printer file not found: 0:/sys/konfiguration-\u00fc.g"},
+    {"files": [{"file": "sys/config.g", "status": "modified", "hunks": [{"index": 0, "header": "@@ -1 +1 @@"}]}]},
+    {"branches": [], "activeBranch": None, "exact": False, "count": 3},
+]
+
+
+class TestJsonBackends:
+    """The orjson and stdlib branches of _dumps/_loads must agree."""
+
+    @pytest.fixture
+    def stdlib_daemon(self, import_daemon, monkeypatch):
+        # A None entry in sys.modules makes "import orjson" raise ImportError
+        with monkeypatch.context() as mp:
+            mp.setitem(sys.modules, "orjson", None)
+            return import_daemon()
+
+    @pytest.fixture
+    def orjson_daemon(self, import_daemon):
+        pytest.importorskip("orjson")
+        daemon = import_daemon()
+        assert daemon._loads is sys.modules["orjson"].loads
+        return daemon
+
+    @pytest.mark.parametrize("payload", _JSON_PAYLOADS)
+    def test_response_bodies_identical(self, stdlib_daemon, orjson_daemon, payload):
+        fast = orjson_daemon.json_response(payload)
+        slow = stdlib_daemon.json_response(payload)
+        assert fast == slow
+        assert isinstance(fast["body"], str)
+        assert json.loads(fast["body"]) == payload
+
+    def test_invalid_json_raises_stdlib_error(self, stdlib_daemon, orjson_daemon):
+        for daemon in (stdlib_daemon, orjson_daemon):
+            with pytest.raises(json.JSONDecodeError):
+                daemon._loads("not json")
 
 
 class TestHandlers:
-    def test_status(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_status(self, daemon, cmd, manager):
         manager.get_branches.return_value = ["main"]
 
-        cmd.get_object_model.return_value = SimpleNamespace(
-            plugins={"MeltingplotConfig": SimpleNamespace(data={
-                "status": "up_to_date",
-                "detectedFirmwareVersion": "3.5",
-                "activeBranch": "3.5",
-                "referenceRepoUrl": "https://example.com",
-                "lastSyncTimestamp": "2026-01-01T00:00:00",
-            })}
-        )
+        cmd.get_object_model.return_value = _OBJECT_MODEL
 
         resp = daemon.handle_status(cmd, manager, "", {})
         assert resp["status"] == 200
@@ -114,20 +109,14 @@ class TestHandlers:
         assert body["status"] == "up_to_date"
         assert body["detectedFirmwareVersion"] == "3.5"
 
-    def test_branches(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_branches(self, daemon, cmd, manager):
         manager.get_branches.return_value = ["main", "3.5"]
 
         resp = daemon.handle_branches(cmd, manager, "", {})
         body = json.loads(resp["body"])
         assert "branches" in body
 
-    def test_diff_all(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_diff_all(self, daemon, cmd, manager):
         manager.diff_all.return_value = [{"file": "sys/config.g", "status": "modified"}]
 
         # No file query param → diff all
@@ -137,10 +126,7 @@ class TestHandlers:
         assert "files" in body
         manager.diff_all.assert_called_once()
 
-    def test_diff_single_file(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_diff_single_file(self, daemon, cmd, manager):
         manager.diff_file.return_value = {
             "file": "sys/config.g", "status": "unchanged", "hunks": [], "unifiedDiff": ""
         }
@@ -150,10 +136,7 @@ class TestHandlers:
         assert resp["status"] == 200
         manager.diff_file.assert_called_once_with("sys/config.g")
 
-    def test_apply_all(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_apply_all(self, daemon, cmd, manager):
         manager.apply_all.return_value = {"applied": ["sys/config.g"]}
 
         # No file param → apply all
@@ -161,10 +144,7 @@ class TestHandlers:
         assert resp["status"] == 200
         manager.apply_all.assert_called_once()
 
-    def test_apply_single_file(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_apply_single_file(self, daemon, cmd, manager):
         manager.apply_file.return_value = {"applied": ["sys/config.g"]}
 
         # With file param → apply single file
@@ -172,46 +152,28 @@ class TestHandlers:
         assert resp["status"] == 200
         manager.apply_file.assert_called_once_with("sys/config.g")
 
-    def test_apply_hunks(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_apply_hunks(self, daemon, cmd, manager):
         manager.apply_hunks.return_value = {"applied": [0, 2], "failed": []}
 
-        body = json.dumps({"hunks": [0, 2]})
+        body = '{"hunks": [0, 2]}'
         resp = daemon.handle_apply_hunks(cmd, manager, body, {"file": "sys/config.g"})
         assert resp["status"] == 200
         manager.apply_hunks.assert_called_once_with("sys/config.g", [0, 2])
 
-    def test_apply_hunks_missing_file(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
-
+    def test_apply_hunks_missing_file(self, daemon, cmd, manager):
         resp = daemon.handle_apply_hunks(cmd, manager, '{"hunks": [0]}', {})
         assert resp["status"] == 400
 
-    def test_apply_hunks_invalid_json(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
-
+    def test_apply_hunks_invalid_json(self, daemon, cmd, manager):
         resp = daemon.handle_apply_hunks(cmd, manager, "not json", {"file": "sys/config.g"})
         assert resp["status"] == 400
 
-    def test_settings_post(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
-
-        body = json.dumps({"referenceRepoUrl": "https://example.com/repo.git"})
+    def test_settings_post(self, daemon, cmd, manager):
+        body = '{"referenceRepoUrl": "https://example.com/repo.git"}'
         resp = daemon.handle_settings(cmd, manager, body, {})
         assert resp["status"] == 200
 
-    def test_backup_detail(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_backup_detail(self, daemon, cmd, manager):
         manager.get_backup_files.return_value = ["sys/config.g", "sys/homex.g"]
         manager.get_backup_changed_files.return_value = ["sys/config.g"]
 
@@ -222,18 +184,11 @@ class TestHandlers:
         assert "sys/config.g" in body["files"]
         assert body["changedFiles"] == ["sys/config.g"]
 
-    def test_backup_detail_missing_hash(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
-
+    def test_backup_detail_missing_hash(self, daemon, cmd, manager):
         resp = daemon.handle_backup(cmd, manager, "", {})
         assert resp["status"] == 400
 
-    def test_backup_download(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_backup_download(self, daemon, cmd, manager):
         manager.get_backup_download.return_value = b"PK\x03\x04fake"
 
         resp = daemon.handle_backup_download(cmd, manager, "", {"hash": "abc123"})
@@ -241,27 +196,17 @@ class TestHandlers:
         assert resp["contentType"] == "application/zip"
         assert resp["responseType"] == "file"
 
-    def test_restore(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_restore(self, daemon, cmd, manager):
         manager.restore_backup.return_value = {"restored": ["sys/config.g"]}
 
         resp = daemon.handle_restore(cmd, manager, "", {"hash": "abc123"})
         assert resp["status"] == 200
 
-    def test_restore_missing_hash(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
-
+    def test_restore_missing_hash(self, daemon, cmd, manager):
         resp = daemon.handle_restore(cmd, manager, "", {})
         assert resp["status"] == 400
 
-    def test_manual_backup(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_manual_backup(self, daemon, cmd, manager):
         manager.create_manual_backup.return_value = {
             "backup": {"hash": "abc123", "message": "Manual backup"}
         }
@@ -272,31 +217,21 @@ class TestHandlers:
         assert "backup" in body
         manager.create_manual_backup.assert_called_once_with("")
 
-    def test_manual_backup_with_message(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_manual_backup_with_message(self, daemon, cmd, manager):
         manager.create_manual_backup.return_value = {
             "backup": {"hash": "abc123", "message": "My note"}
         }
 
-        body = json.dumps({"message": "My note"})
+        body = '{"message": "My note"}'
         resp = daemon.handle_manual_backup(cmd, manager, body, {})
         assert resp["status"] == 200
         manager.create_manual_backup.assert_called_once_with("My note")
 
-    def test_manual_backup_invalid_json(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
-
+    def test_manual_backup_invalid_json(self, daemon, cmd, manager):
         resp = daemon.handle_manual_backup(cmd, manager, "not json", {})
         assert resp["status"] == 400
 
-    def test_manual_backup_error(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_manual_backup_error(self, daemon, cmd, manager):
         manager.create_manual_backup.return_value = {
             "error": "Reference repository not cloned"
         }
@@ -304,10 +239,7 @@ class TestHandlers:
         resp = daemon.handle_manual_backup(cmd, manager, "", {})
         assert resp["status"] == 400
 
-    def test_backup_file_content(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_backup_file_content(self, daemon, cmd, manager):
         manager.get_backup_file_content.return_value = {
             "file": "sys/config.g",
             "status": "ok",
@@ -322,26 +254,15 @@ class TestHandlers:
         assert body["content"] == "G28\nM584 X0 Y1\n"
         manager.get_backup_file_content.assert_called_once_with("abc123", "sys/config.g")
 
-    def test_backup_file_content_missing_hash(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
-
+    def test_backup_file_content_missing_hash(self, daemon, cmd, manager):
         resp = daemon.handle_backup_file_content(cmd, manager, "", {"file": "sys/config.g"})
         assert resp["status"] == 400
 
-    def test_backup_file_content_missing_file(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
-
+    def test_backup_file_content_missing_file(self, daemon, cmd, manager):
         resp = daemon.handle_backup_file_content(cmd, manager, "", {"hash": "abc123"})
         assert resp["status"] == 400
 
-    def test_backup_file_diff(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_backup_file_diff(self, daemon, cmd, manager):
         manager.get_backup_file_diff.return_value = {
             "file": "sys/config.g",
             "status": "modified",
@@ -356,45 +277,37 @@ class TestHandlers:
         assert len(body["hunks"]) == 1
         manager.get_backup_file_diff.assert_called_once_with("abc123", "sys/config.g")
 
-    def test_backup_file_diff_missing_hash(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
-
+    def test_backup_file_diff_missing_hash(self, daemon, cmd, manager):
         resp = daemon.handle_backup_file_diff(cmd, manager, "", {"file": "sys/config.g"})
         assert resp["status"] == 400
 
-    def test_backup_file_diff_missing_file(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
-
+    def test_backup_file_diff_missing_file(self, daemon, cmd, manager):
         resp = daemon.handle_backup_file_diff(cmd, manager, "", {"hash": "abc123"})
         assert resp["status"] == 400
 
 
 class TestEndpointRegistry:
-    def test_endpoints_registered(self):
-        daemon = _import_daemon()
-        endpoints = daemon.ENDPOINTS
-        # Check expected endpoints
-        assert ("GET", "status") in endpoints
-        assert ("POST", "sync") in endpoints
-        assert ("GET", "diff") in endpoints
-        assert ("GET", "branches") in endpoints
-        assert ("GET", "reference") in endpoints
-        assert ("GET", "backups") in endpoints
-        assert ("POST", "manualBackup") in endpoints
-        assert ("POST", "apply") in endpoints
-        assert ("POST", "applyHunks") in endpoints
-        assert ("GET", "backup") in endpoints
-        assert ("GET", "backupDownload") in endpoints
-        assert ("GET", "backupFileContent") in endpoints
-        assert ("GET", "backupFileDiff") in endpoints
-        assert ("POST", "restore") in endpoints
-        assert ("POST", "settings") in endpoints
-
-    def test_all_endpoints_are_callable(self):
-        daemon = _import_daemon()
-        for key, handler in daemon.ENDPOINTS.items():
-            assert callable(handler), f"Handler for {key} is not callable"
+    def test_endpoints_registered(self, daemon):
+        expected = {
+            ("GET", "status"),
+            ("POST", "sync"),
+            ("GET", "diff"),
+            ("GET", "branches"),
+            ("GET", "reference"),
+            ("GET", "backups"),
+            ("POST", "manualBackup"),
+            ("POST", "apply"),
+            ("POST", "applyHunks"),
+            ("GET", "backup"),
+            ("GET", "backupDownload"),
+            ("GET", "backupFileContent"),
+            ("GET", "backupFileDiff"),
+            ("POST", "restore"),
+            ("POST", "settings"),
+        }
+        missing = expected - daemon.ENDPOINTS.keys()
+        assert not missing, f"missing endpoints: {missing}"
+
+    def test_all_endpoints_are_callable(self, daemon):
+        not_callable = [key for key, handler in daemon.ENDPOINTS.items() if not callable(handler)]
+        assert not not_callable, f"handlers are not callable: {not_callable}"
@@ -1,121 +1,64 @@
 """Tests for daemon handler logic — handle_sync, handle_apply internals,
 plugin data helpers, handle_reference, handle_backup edge cases."""
 
-import importlib.util
 import json
-import os
-import sys
-import types
 from types import SimpleNamespace
-from unittest.mock import MagicMock, patch, call
+from unittest.mock import Mock, patch
 
 import pytest
 
 
-@pytest.fixture(autouse=True)
-def mock_dsf_modules(monkeypatch):
-    """Mock the dsf library modules so the daemon can be imported."""
-    dsf_mod = types.ModuleType("dsf")
-    dsf_connections = types.ModuleType("dsf.connections")
-    dsf_commands = types.ModuleType("dsf.commands")
-    dsf_commands_code = types.ModuleType("dsf.commands.code")
-    dsf_http = types.ModuleType("dsf.http")
-    dsf_object_model = types.ModuleType("dsf.object_model")
-
-    dsf_connections.CommandConnection = MagicMock
-    dsf_connections.InterceptConnection = MagicMock
-    dsf_commands_code.CodeResult = MagicMock
-
-    class FakeHttpEndpointType:
-        GET = "GET"
-        POST = "POST"
-
-    class FakeHttpResponseType:
-        StatusCode = "StatusCode"
-        PlainText = "PlainText"
-        JSON = "JSON"
-        File = "File"
-        URI = "URI"
-
-    dsf_http.HttpEndpointConnection = MagicMock
-    dsf_http.HttpResponseType = FakeHttpResponseType
-    dsf_object_model.HttpEndpointType = FakeHttpEndpointType
-
-    monkeypatch.setitem(sys.modules, "dsf", dsf_mod)
-    monkeypatch.setitem(sys.modules, "dsf.connections", dsf_connections)
-    monkeypatch.setitem(sys.modules, "dsf.commands", dsf_commands)
-    monkeypatch.setitem(sys.modules, "dsf.commands.code", dsf_commands_code)
-    monkeypatch.setitem(sys.modules, "dsf.http", dsf_http)
-    monkeypatch.setitem(sys.modules, "dsf.object_model", dsf_object_model)
-
-
-def _import_daemon():
-    """Import (or reimport) the daemon module."""
-    spec = importlib.util.spec_from_file_location(
-        "daemon_mod",
-        os.path.join(os.path.dirname(__file__), "..", "dsf", "meltingplot-config-daemon.py"),
-    )
-    mod = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(mod)
-    return mod
+def _make_cmd(plugin_data=None, boards=None):
+    """Build a command connection whose object model holds the given data."""
+    model = SimpleNamespace()
+    if plugin_data is not None:
+        model.plugins = {"MeltingplotConfig": SimpleNamespace(data=plugin_data)}
+    if boards is not None:
+        model.boards = boards
+    cmd = Mock()
+    cmd.get_object_model.return_value = model
+    return cmd
 
 
 # --- Plugin data helpers ---
 
 
 class TestGetPluginData:
-    def test_returns_plugin_data(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        plugin = SimpleNamespace(data={
-            "status": "up_to_date", "activeBranch": "3.5"
-        })
-        cmd.get_object_model.return_value = SimpleNamespace(
-            plugins={"MeltingplotConfig": plugin}
-        )
+    def test_returns_plugin_data(self, daemon):
+        cmd = _make_cmd({"status": "up_to_date", "activeBranch": "3.5"})
         data = daemon.get_plugin_data(cmd)
         assert data["status"] == "up_to_date"
         assert data["activeBranch"] == "3.5"
 
-    def test_returns_empty_dict_when_no_plugins(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        cmd.get_object_model.return_value = SimpleNamespace(plugins={})
+    @pytest.mark.parametrize("model", [
+        pytest.param(SimpleNamespace(plugins={}), id="no_plugins"),
+        pytest.param(
+            SimpleNamespace(plugins={"OtherPlugin": SimpleNamespace(data={"status": "x"})}),
+            id="plugin_missing",
+        ),
+        pytest.param(SimpleNamespace(), id="no_plugins_key"),
+    ])
+    def test_returns_empty_dict(self, daemon, model):
+        cmd = Mock()
+        cmd.get_object_model.return_value = model
         data = daemon.get_plugin_data(cmd)
         assert data == {}
 
-    def test_returns_empty_dict_when_plugin_missing(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        cmd.get_object_model.return_value = SimpleNamespace(plugins={})
-        data = daemon.get_plugin_data(cmd)
-        assert data == {}
-
-    def test_returns_empty_dict_when_no_plugins_key(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        cmd.get_object_model.return_value = SimpleNamespace()
-        data = daemon.get_plugin_data(cmd)
-        assert data == {}
-
-    def test_returns_empty_dict_on_exception(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
+    def test_returns_empty_dict_on_exception(self, daemon):
+        cmd = Mock()
         cmd.get_object_model.side_effect = Exception("connection lost")
         data = daemon.get_plugin_data(cmd)
         assert data == {}
 
 
 class TestSetPluginData:
-    def test_sets_data_successfully(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
+    def test_sets_data_successfully(self, daemon):
+        cmd = Mock()
         daemon.set_plugin_data(cmd, "activeBranch", "3.5")
         cmd.set_plugin_data.assert_called_once_with("MeltingplotConfig", "activeBranch", "3.5")
 
-    def test_logs_warning_on_failure(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
+    def test_logs_warning_on_failure(self, daemon):
+        cmd = Mock()
         cmd.set_plugin_data.side_effect = Exception("write failed")
         # Should not raise, just log
         daemon.set_plugin_data(cmd, "key", "value")
@@ -125,17 +68,13 @@ class TestSetPluginData:
 
 
 class TestHandleSync:
-    def test_sync_success_updates_plugin_data(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        cmd.get_object_model.return_value = SimpleNamespace(
-            plugins={"MeltingplotConfig": SimpleNamespace(data={
-                "referenceRepoUrl": "https://example.com/repo.git",
-                "detectedFirmwareVersion": "3.5.1",
-                "firmwareBranchOverride": "",
-            })}
-        )
-        manager = MagicMock()
+    def test_sync_success_updates_plugin_data(self, daemon):
+        cmd = _make_cmd({
+            "referenceRepoUrl": "https://example.com/repo.git",
+            "detectedFirmwareVersion": "3.5.1",
+            "firmwareBranchOverride": "",
+        })
+        manager = Mock()
         manager.sync.return_value = {
             "activeBranch": "3.5",
             "exact": False,
@@ -158,15 +97,9 @@ class TestHandleSync:
         assert "lastSyncTimestamp" in keys_set
         assert "status" in keys_set
 
-    def test_sync_error_returns_400(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        cmd.get_object_model.return_value = SimpleNamespace(
-            plugins={"MeltingplotConfig": SimpleNamespace(data={
-                "referenceRepoUrl": "", "detectedFirmwareVersion": "", "firmwareBranchOverride": ""
-            })}
-        )
-        manager = MagicMock()
+    def test_sync_error_returns_400(self, daemon):
+        cmd = _make_cmd({"referenceRepoUrl": "", "detectedFirmwareVersion": "", "firmwareBranchOverride": ""})
+        manager = Mock()
         manager.sync.return_value = {"error": "No reference repository URL configured"}
 
         resp = daemon.handle_sync(cmd, manager, "", {})
@@ -174,17 +107,13 @@ class TestHandleSync:
         body = json.loads(resp["body"])
         assert "error" in body
 
-    def test_sync_passes_branch_override(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        cmd.get_object_model.return_value = SimpleNamespace(
-            plugins={"MeltingplotConfig": SimpleNamespace(data={
-                "referenceRepoUrl": "https://example.com/repo.git",
-                "detectedFirmwareVersion": "3.5.1",
-                "firmwareBranchOverride": "custom-branch",
-            })}
-        )
-        manager = MagicMock()
+    def test_sync_passes_branch_override(self, daemon):
+        cmd = _make_cmd({
+            "referenceRepoUrl": "https://example.com/repo.git",
+            "detectedFirmwareVersion": "3.5.1",
+            "firmwareBranchOverride": "custom-branch",
+        })
+        manager = Mock()
         manager.sync.return_value = {
             "activeBranch": "custom-branch",
             "exact": True,
@@ -202,19 +131,17 @@ class TestHandleSync:
 
 
 class TestHandleApplyFileInternals:
-    def test_apply_hunks_missing_file_returns_400(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_apply_hunks_missing_file_returns_400(self, daemon):
+        cmd = Mock()
+        manager = Mock()
 
         # No file query param
         resp = daemon.handle_apply_hunks(cmd, manager, '{"hunks": [0]}', {})
         assert resp["status"] == 400
 
-    def test_hunks_not_a_list_returns_400(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_hunks_not_a_list_returns_400(self, daemon):
+        cmd = Mock()
+        manager = Mock()
 
         body = json.dumps({"hunks": "not-a-list"})
         resp = daemon.handle_apply_hunks(cmd, manager, body, {"file": "sys/config.g"})
@@ -222,28 +149,54 @@ class TestHandleApplyFileInternals:
         body_data = json.loads(resp["body"])
         assert "list" in body_data["error"]
 
-    def test_apply_file_error_from_manager(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_apply_hunks_oversized_body_returns_413(self, daemon):
+        manager = Mock()
+
+        body = json.dumps({"hunks": [0], "pad": "x" * daemon.MAX_BODY_SIZE})
+        resp = daemon.handle_apply_hunks(Mock(), manager, body, {"file": "sys/config.g"})
+        assert resp["status"] == 413
+        manager.apply_hunks.assert_not_called()
+
+    def test_apply_hunks_multibyte_body_measured_in_bytes(self, daemon):
+        manager = Mock()
+
+        # Fewer characters than MAX_BODY_SIZE, but more bytes once encoded
+        body = json.dumps(
+            {"hunks": [0], "pad": "\u00e9" * (daemon.MAX_BODY_SIZE // 2)},
+            ensure_ascii=False,
+        )
+        assert len(body) < daemon.MAX_BODY_SIZE
+        resp = daemon.handle_apply_hunks(Mock(), manager, body, {"file": "sys/config.g"})
+        assert resp["status"] == 413
+        manager.apply_hunks.assert_not_called()
+
+    def test_apply_hunks_too_many_hunks_returns_400(self, daemon):
+        manager = Mock()
+
+        body = json.dumps({"hunks": [0] * (daemon.MAX_HUNK_SELECTION + 1)})
+        resp = daemon.handle_apply_hunks(Mock(), manager, body, {"file": "sys/config.g"})
+        assert resp["status"] == 400
+        manager.apply_hunks.assert_not_called()
+
+    def test_apply_file_error_from_manager(self, daemon):
+        cmd = Mock()
+        manager = Mock()
         manager.apply_file.return_value = {"error": "Unknown reference path: bad/path.g"}
 
         resp = daemon.handle_apply(cmd, manager, "", {"file": "bad/path.g"})
         assert resp["status"] == 400
 
-    def test_apply_hunks_empty_body(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_apply_hunks_empty_body(self, daemon):
+        cmd = Mock()
+        manager = Mock()
         manager.apply_hunks.return_value = {"applied": [], "failed": []}
 
         resp = daemon.handle_apply_hunks(cmd, manager, "", {"file": "sys/config.g"})
         assert resp["status"] == 200
 
-    def test_url_decodes_file_path(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_url_decodes_file_path(self, daemon):
+        cmd = Mock()
+        manager = Mock()
         manager.apply_file.return_value = {"applied": ["sys/config file.g"]}
 
         resp = daemon.handle_apply(cmd, manager, "", {"file": "sys/config%20file.g"})
@@ -255,48 +208,39 @@ class TestHandleApplyFileInternals:
 
 
 class TestHandleReference:
-    def test_reference_repo_not_cloned(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_reference_lists_manager_files(self, daemon):
+        manager = Mock()
+        manager.get_reference_files.return_value = ["sys/config.g", "sys/homex.g"]
 
-        with patch("os.path.isdir", return_value=False):
-            resp = daemon.handle_reference(cmd, manager, "", {})
+        resp = daemon.handle_reference(Mock(), manager, "", {})
 
         body = json.loads(resp["body"])
-        assert body["files"] == []
+        assert body["files"] == ["sys/config.g", "sys/homex.g"]
 
-    def test_reference_repo_lists_files(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_reference_repo_not_cloned(self, daemon):
+        manager = Mock()
+        manager.get_reference_files.return_value = []
 
-        with (
-            patch("os.path.isdir", return_value=True),
-            patch("git_utils.list_files", return_value=["sys/config.g", "sys/homex.g"]),
-        ):
-            resp = daemon.handle_reference(cmd, manager, "", {})
+        resp = daemon.handle_reference(Mock(), manager, "", {})
 
         body = json.loads(resp["body"])
-        assert "sys/config.g" in body["files"]
+        assert body["files"] == []
 
 
 # --- handle_backup edge cases ---
 
 
 class TestHandleBackupDetailEdgeCases:
-    def test_missing_commit_hash(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_missing_commit_hash(self, daemon):
+        cmd = Mock()
+        manager = Mock()
 
         resp = daemon.handle_backup(cmd, manager, "", {})
         assert resp["status"] == 400
 
-    def test_includes_changed_files(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_includes_changed_files(self, daemon):
+        cmd = Mock()
+        manager = Mock()
         manager.get_backup_files.return_value = ["sys/config.g", "sys/homex.g"]
         manager.get_backup_changed_files.return_value = ["sys/config.g"]
 
@@ -307,10 +251,9 @@ class TestHandleBackupDetailEdgeCases:
 
 
 class TestHandleBackupFileContent:
-    def test_returns_content(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_returns_content(self, daemon):
+        cmd = Mock()
+        manager = Mock()
         manager.get_backup_file_content.return_value = {
             "file": "sys/config.g", "status": "ok",
             "content": "G28\nM584 X0 Y1\n",
@@ -321,28 +264,24 @@ class TestHandleBackupFileContent:
         assert body["status"] == "ok"
         assert body["content"] == "G28\nM584 X0 Y1\n"
 
-    def test_missing_hash(self):
-        daemon = _import_daemon()
-        resp = daemon.handle_backup_file_content(MagicMock(), MagicMock(), "", {"file": "x"})
+    def test_missing_hash(self, daemon):
+        resp = daemon.handle_backup_file_content(Mock(), Mock(), "", {"file": "x"})
         assert resp["status"] == 400
 
-    def test_missing_file(self):
-        daemon = _import_daemon()
-        resp = daemon.handle_backup_file_content(MagicMock(), MagicMock(), "", {"hash": "x"})
+    def test_missing_file(self, daemon):
+        resp = daemon.handle_backup_file_content(Mock(), Mock(), "", {"hash": "x"})
         assert resp["status"] == 400
 
-    def test_url_decodes_file_path(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_url_decodes_file_path(self, daemon):
+        cmd = Mock()
+        manager = Mock()
         manager.get_backup_file_content.return_value = {"file": "sys/config file.g", "status": "ok", "content": "test"}
         daemon.handle_backup_file_content(cmd, manager, "", {"hash": "abc", "file": "sys/config%20file.g"})
         manager.get_backup_file_content.assert_called_once_with("abc", "sys/config file.g")
 
-    def test_not_found_returns_ok(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_not_found_returns_ok(self, daemon):
+        cmd = Mock()
+        manager = Mock()
         manager.get_backup_file_content.return_value = {
             "file": "sys/missing.g", "status": "not_found", "content": None,
         }
@@ -354,10 +293,9 @@ class TestHandleBackupFileContent:
 
 
 class TestHandleBackupFileDiff:
-    def test_returns_diff(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_returns_diff(self, daemon):
+        cmd = Mock()
+        manager = Mock()
         manager.get_backup_file_diff.return_value = {
             "file": "sys/config.g", "status": "modified",
             "hunks": [{"index": 0, "header": "@@ -1 +1 @@", "lines": ["-old", "+new"], "summary": "Line 1"}],
@@ -367,37 +305,32 @@ class TestHandleBackupFileDiff:
         body = json.loads(resp["body"])
         assert body["status"] == "modified"
 
-    def test_missing_hash(self):
-        daemon = _import_daemon()
-        resp = daemon.handle_backup_file_diff(MagicMock(), MagicMock(), "", {"file": "x"})
+    def test_missing_hash(self, daemon):
+        resp = daemon.handle_backup_file_diff(Mock(), Mock(), "", {"file": "x"})
         assert resp["status"] == 400
 
-    def test_missing_file(self):
-        daemon = _import_daemon()
-        resp = daemon.handle_backup_file_diff(MagicMock(), MagicMock(), "", {"hash": "x"})
+    def test_missing_file(self, daemon):
+        resp = daemon.handle_backup_file_diff(Mock(), Mock(), "", {"hash": "x"})
         assert resp["status"] == 400
 
-    def test_url_decodes_file_path(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_url_decodes_file_path(self, daemon):
+        cmd = Mock()
+        manager = Mock()
         manager.get_backup_file_diff.return_value = {"file": "sys/config file.g", "status": "modified", "hunks": []}
         daemon.handle_backup_file_diff(cmd, manager, "", {"hash": "abc", "file": "sys/config%20file.g"})
         manager.get_backup_file_diff.assert_called_once_with("abc", "sys/config file.g")
 
-    def test_download_exception_returns_500(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_download_exception_returns_500(self, daemon):
+        cmd = Mock()
+        manager = Mock()
         manager.get_backup_download.side_effect = RuntimeError("git archive failed")
 
         resp = daemon.handle_backup_download(cmd, manager, "", {"hash": "abc123"})
         assert resp["status"] == 500
 
-    def test_download_creates_temp_file(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_download_creates_temp_file(self, daemon):
+        cmd = Mock()
+        manager = Mock()
         manager.get_backup_download.return_value = b"PK\x03\x04zip"
 
         resp = daemon.handle_backup_download(cmd, manager, "", {"hash": "abc12345deadbeef"})
@@ -412,10 +345,9 @@ class TestHandleBackupFileDiff:
 
 
 class TestHandleSettings:
-    def test_settings_sets_repo_url(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_settings_sets_repo_url(self, daemon):
+        cmd = Mock()
+        manager = Mock()
 
         body = json.dumps({"referenceRepoUrl": "https://new.example.com/repo.git"})
         with patch.object(daemon, "save_settings_to_disk"):
@@ -423,10 +355,9 @@ class TestHandleSettings:
         assert resp["status"] == 200
         cmd.set_plugin_data.assert_any_call("MeltingplotConfig", "referenceRepoUrl", "https://new.example.com/repo.git")
 
-    def test_settings_sets_branch_override(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_settings_sets_branch_override(self, daemon):
+        cmd = Mock()
+        manager = Mock()
 
         body = json.dumps({"firmwareBranchOverride": "custom"})
         with patch.object(daemon, "save_settings_to_disk"):
@@ -434,36 +365,40 @@ class TestHandleSettings:
         assert resp["status"] == 200
         cmd.set_plugin_data.assert_any_call("MeltingplotConfig", "firmwareBranchOverride", "custom")
 
-    def test_settings_invalid_json(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_settings_invalid_json(self, daemon):
+        cmd = Mock()
+        manager = Mock()
 
         resp = daemon.handle_settings(cmd, manager, "not json{", {})
         assert resp["status"] == 400
 
-    def test_settings_empty_body(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_settings_empty_body(self, daemon):
+        cmd = Mock()
+        manager = Mock()
 
         resp = daemon.handle_settings(cmd, manager, "", {})
         assert resp["status"] == 200
 
-    def test_settings_ignores_unknown_fields(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_settings_ignores_unknown_fields(self, daemon):
+        cmd = Mock()
+        manager = Mock()
 
         body = json.dumps({"unknownField": "value"})
         resp = daemon.handle_settings(cmd, manager, body, {})
         assert resp["status"] == 200
         cmd.set_plugin_data.assert_not_called()
 
-    def test_settings_persists_to_disk(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_settings_oversized_body_returns_413(self, daemon):
+        cmd = Mock()
+
+        body = json.dumps({"referenceRepoUrl": "x" * daemon.MAX_BODY_SIZE})
+        resp = daemon.handle_settings(cmd, Mock(), body, {})
+        assert resp["status"] == 413
+        cmd.set_plugin_data.assert_not_called()
+
+    def test_settings_persists_to_disk(self, daemon):
+        cmd = Mock()
+        manager = Mock()
 
         body = json.dumps({
             "referenceRepoUrl": "https://example.com/repo.git",
@@ -476,10 +411,9 @@ class TestHandleSettings:
             "firmwareBranchOverride": "3.5",
         })
 
-    def test_settings_does_not_persist_when_no_known_fields(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_settings_does_not_persist_when_no_known_fields(self, daemon):
+        cmd = Mock()
+        manager = Mock()
 
         body = json.dumps({"unknownField": "value"})
         with patch.object(daemon, "save_settings_to_disk") as mock_save:
@@ -491,18 +425,16 @@ class TestHandleSettings:
 
 
 class TestHandleDeleteBackup:
-    def test_delete_missing_hash(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_delete_missing_hash(self, daemon):
+        cmd = Mock()
+        manager = Mock()
 
         resp = daemon.handle_delete_backup(cmd, manager, "", {})
         assert resp["status"] == 400
 
-    def test_delete_success(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_delete_success(self, daemon):
+        cmd = Mock()
+        manager = Mock()
         manager.delete_backup.return_value = {"deleted": "abc123"}
 
         resp = daemon.handle_delete_backup(cmd, manager, "", {"hash": "abc123"})
@@ -511,10 +443,9 @@ class TestHandleDeleteBackup:
         assert body["deleted"] == "abc123"
         manager.delete_backup.assert_called_once_with("abc123")
 
-    def test_delete_runtime_error_returns_400(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_delete_runtime_error_returns_400(self, daemon):
+        cmd = Mock()
+        manager = Mock()
         manager.delete_backup.side_effect = RuntimeError("Cannot delete the only backup")
 
         resp = daemon.handle_delete_backup(cmd, manager, "", {"hash": "abc123"})
@@ -524,18 +455,16 @@ class TestHandleDeleteBackup:
 
 
 class TestHandleRestoreEdgeCases:
-    def test_restore_missing_hash(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_restore_missing_hash(self, daemon):
+        cmd = Mock()
+        manager = Mock()
 
         resp = daemon.handle_restore(cmd, manager, "", {})
         assert resp["status"] == 400
 
-    def test_restore_error_from_manager(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_restore_error_from_manager(self, daemon):
+        cmd = Mock()
+        manager = Mock()
         manager.restore_backup.return_value = {"error": "commit not found"}
 
         resp = daemon.handle_restore(cmd, manager, "", {"hash": "bad_hash"})
@@ -546,19 +475,17 @@ class TestHandleRestoreEdgeCases:
 
 
 class TestHandleDiffEdgeCases:
-    def test_diff_file_error_from_manager(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_diff_file_error_from_manager(self, daemon):
+        cmd = Mock()
+        manager = Mock()
         manager.diff_file.return_value = {"error": "Unknown reference path"}
 
         resp = daemon.handle_diff(cmd, manager, "", {"file": "unknown/file.g"})
         assert resp["status"] == 400
 
-    def test_diff_all_returns_files(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_diff_all_returns_files(self, daemon):
+        cmd = Mock()
+        manager = Mock()
         manager.diff_all.return_value = [
             {"file": "sys/config.g", "status": "modified", "hunks": []}
         ]
@@ -572,11 +499,10 @@ class TestHandleDiffEdgeCases:
 
 
 class TestRegisterEndpoints:
-    def test_registers_all_endpoints(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
-        endpoint_mock = MagicMock()
+    def test_registers_all_endpoints(self, daemon):
+        cmd = Mock()
+        manager = Mock()
+        endpoint_mock = Mock()
         cmd.add_http_endpoint.return_value = endpoint_mock
         registered = daemon.register_endpoints(cmd, manager)
         assert len(registered) > 0
@@ -584,10 +510,9 @@ class TestRegisterEndpoints:
         # Each endpoint should have set_endpoint_handler called
         assert endpoint_mock.set_endpoint_handler.call_count == len(registered)
 
-    def test_handles_registration_failure(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        manager = MagicMock()
+    def test_handles_registration_failure(self, daemon):
+        cmd = Mock()
+        manager = Mock()
         cmd.add_http_endpoint.side_effect = Exception("DSF not ready")
         registered = daemon.register_endpoints(cmd, manager)
         # Should return empty list but not crash
@@ -603,10 +528,7 @@ class TestFirmwareDetection:
     dict-style .get() which fails on the real DSF ObjectModel."""
 
     def test_detects_firmware_from_object_model(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        board = SimpleNamespace(firmware_version="3.5.1")
-        cmd.get_object_model.return_value = SimpleNamespace(boards=[board])
+        cmd = _make_cmd(boards=[SimpleNamespace(firmware_version="3.5.1")])
 
         # Simulate the firmware detection logic from main()
         model = cmd.get_object_model()
@@ -617,28 +539,21 @@ class TestFirmwareDetection:
         assert fw == "3.5.1"
 
     def test_handles_empty_boards_list(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        cmd.get_object_model.return_value = SimpleNamespace(boards=[])
+        cmd = _make_cmd(boards=[])
 
         model = cmd.get_object_model()
         boards = getattr(model, "boards", None) or []
         assert boards == []
 
     def test_handles_missing_boards_attr(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        cmd.get_object_model.return_value = SimpleNamespace()
+        cmd = _make_cmd()
 
         model = cmd.get_object_model()
         boards = getattr(model, "boards", None) or []
         assert boards == []
 
     def test_handles_none_firmware_version(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        board = SimpleNamespace(firmware_version=None)
-        cmd.get_object_model.return_value = SimpleNamespace(boards=[board])
+        cmd = _make_cmd(boards=[SimpleNamespace(firmware_version=None)])
 
         model = cmd.get_object_model()
         boards = getattr(model, "boards", None) or []
@@ -766,8 +681,7 @@ class TestBoardStateMonkeyPatch:
 class TestBuildDirectoryMap:
     """Tests for build_directory_map which reads model.directories."""
 
-    def test_builds_map_from_directories(self):
-        daemon = _import_daemon()
+    def test_builds_map_from_directories(self, daemon):
         dirs = SimpleNamespace(
             filaments="0:/filaments",
             firmware="0:/firmware",
@@ -789,8 +703,7 @@ class TestBuildDirectoryMap:
             "www/": "0:/www/",
         }
 
-    def test_handles_trailing_slashes(self):
-        daemon = _import_daemon()
+    def test_handles_trailing_slashes(self, daemon):
         dirs = SimpleNamespace(
             filaments="0:/filaments/",
             firmware="0:/firmware/",
@@ -805,20 +718,17 @@ class TestBuildDirectoryMap:
         assert result["sys/"] == "0:/sys/"
         assert result["macros/"] == "0:/macros/"
 
-    def test_missing_directories_attr(self):
-        daemon = _import_daemon()
+    def test_missing_directories_attr(self, daemon):
         model = SimpleNamespace()
         result = daemon.build_directory_map(model)
         assert result == {}
 
-    def test_none_directories(self):
-        daemon = _import_daemon()
+    def test_none_directories(self, daemon):
         model = SimpleNamespace(directories=None)
         result = daemon.build_directory_map(model)
         assert result == {}
 
-    def test_skips_none_values(self):
-        daemon = _import_daemon()
+    def test_skips_none_values(self, daemon):
         dirs = SimpleNamespace(
             filaments=None,
             firmware="0:/firmware",
@@ -839,101 +749,84 @@ class TestBuildDirectoryMap:
 # --- Persistent settings ---
 
 
+@pytest.fixture
+def settings_file(daemon, tmp_path, monkeypatch):
+    """Point the daemon's SETTINGS_FILE at a file under tmp_path."""
+    path = tmp_path / "settings.json"
+    monkeypatch.setattr(daemon, "SETTINGS_FILE", str(path))
+    return path
+
+
 class TestLoadSettingsFromDisk:
-    def test_loads_valid_json(self, tmp_path):
-        daemon = _import_daemon()
-        settings_file = tmp_path / "settings.json"
+    def test_loads_valid_json(self, daemon, settings_file):
         settings_file.write_text(json.dumps({
             "referenceRepoUrl": "https://example.com/repo.git",
             "activeBranch": "3.5",
         }))
-        with patch.object(daemon, "SETTINGS_FILE", str(settings_file)):
-            result = daemon.load_settings_from_disk()
+        result = daemon.load_settings_from_disk()
         assert result["referenceRepoUrl"] == "https://example.com/repo.git"
         assert result["activeBranch"] == "3.5"
 
-    def test_returns_empty_dict_when_file_missing(self, tmp_path):
-        daemon = _import_daemon()
-        with patch.object(daemon, "SETTINGS_FILE", str(tmp_path / "missing.json")):
-            result = daemon.load_settings_from_disk()
+    def test_returns_empty_dict_when_file_missing(self, daemon, settings_file):
+        result = daemon.load_settings_from_disk()
         assert result == {}
 
-    def test_returns_empty_dict_on_corrupt_json(self, tmp_path):
-        daemon = _import_daemon()
-        settings_file = tmp_path / "settings.json"
+    def test_returns_empty_dict_on_corrupt_json(self, daemon, settings_file):
         settings_file.write_text("not valid json{")
-        with patch.object(daemon, "SETTINGS_FILE", str(settings_file)):
-            result = daemon.load_settings_from_disk()
+        result = daemon.load_settings_from_disk()
         assert result == {}
 
-    def test_filters_out_unknown_keys(self, tmp_path):
-        daemon = _import_daemon()
-        settings_file = tmp_path / "settings.json"
+    def test_filters_out_unknown_keys(self, daemon, settings_file):
         settings_file.write_text(json.dumps({
             "referenceRepoUrl": "url",
             "badKey": "should be filtered",
         }))
-        with patch.object(daemon, "SETTINGS_FILE", str(settings_file)):
-            result = daemon.load_settings_from_disk()
+        result = daemon.load_settings_from_disk()
         assert "referenceRepoUrl" in result
         assert "badKey" not in result
 
-    def test_returns_empty_dict_when_not_a_dict(self, tmp_path):
-        daemon = _import_daemon()
-        settings_file = tmp_path / "settings.json"
+    def test_returns_empty_dict_when_not_a_dict(self, daemon, settings_file):
         settings_file.write_text(json.dumps(["not", "a", "dict"]))
-        with patch.object(daemon, "SETTINGS_FILE", str(settings_file)):
-            result = daemon.load_settings_from_disk()
+        result = daemon.load_settings_from_disk()
         assert result == {}
 
 
 class TestSaveSettingsToDisk:
-    def test_saves_persisted_keys(self, tmp_path):
-        daemon = _import_daemon()
-        settings_file = tmp_path / "settings.json"
-        with patch.object(daemon, "SETTINGS_FILE", str(settings_file)):
-            daemon.save_settings_to_disk({
-                "referenceRepoUrl": "https://example.com/repo.git",
-                "firmwareBranchOverride": "custom",
-            })
+    def test_saves_persisted_keys(self, daemon, settings_file):
+        daemon.save_settings_to_disk({
+            "referenceRepoUrl": "https://example.com/repo.git",
+            "firmwareBranchOverride": "custom",
+        })
         data = json.loads(settings_file.read_text())
         assert data["referenceRepoUrl"] == "https://example.com/repo.git"
         assert data["firmwareBranchOverride"] == "custom"
 
-    def test_merges_with_existing_data(self, tmp_path):
-        daemon = _import_daemon()
-        settings_file = tmp_path / "settings.json"
+    def test_merges_with_existing_data(self, daemon, settings_file):
         settings_file.write_text(json.dumps({
             "referenceRepoUrl": "https://old.example.com/repo.git",
             "activeBranch": "3.5",
         }))
-        with patch.object(daemon, "SETTINGS_FILE", str(settings_file)):
-            daemon.save_settings_to_disk({"activeBranch": "3.6"})
+        daemon.save_settings_to_disk({"activeBranch": "3.6"})
         data = json.loads(settings_file.read_text())
         assert data["referenceRepoUrl"] == "https://old.example.com/repo.git"
         assert data["activeBranch"] == "3.6"
 
-    def test_ignores_unknown_keys(self, tmp_path):
-        daemon = _import_daemon()
-        settings_file = tmp_path / "settings.json"
-        with patch.object(daemon, "SETTINGS_FILE", str(settings_file)):
-            daemon.save_settings_to_disk({
-                "referenceRepoUrl": "url",
-                "unknownKey": "should not appear",
-            })
+    def test_ignores_unknown_keys(self, daemon, settings_file):
+        daemon.save_settings_to_disk({
+            "referenceRepoUrl": "url",
+            "unknownKey": "should not appear",
+        })
         data = json.loads(settings_file.read_text())
         assert "referenceRepoUrl" in data
         assert "unknownKey" not in data
 
-    def test_creates_parent_directories(self, tmp_path):
-        daemon = _import_daemon()
+    def test_creates_parent_directories(self, daemon, tmp_path):
         settings_file = tmp_path / "subdir" / "settings.json"
         with patch.object(daemon, "SETTINGS_FILE", str(settings_file)):
             daemon.save_settings_to_disk({"referenceRepoUrl": "url"})
         assert settings_file.exists()
 
-    def test_handles_write_failure_gracefully(self, tmp_path):
-        daemon = _import_daemon()
+    def test_handles_write_failure_gracefully(self, daemon):
         # Use a path that cannot be written (read-only dir)
         with patch.object(daemon, "SETTINGS_FILE", "/proc/nonexistent/settings.json"):
             # Should not raise
@@ -941,17 +834,13 @@ class TestSaveSettingsToDisk:
 
 
 class TestHandleSyncPersistence:
-    def test_sync_persists_to_disk(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        cmd.get_object_model.return_value = SimpleNamespace(
-            plugins={"MeltingplotConfig": SimpleNamespace(data={
-                "referenceRepoUrl": "https://example.com/repo.git",
-                "detectedFirmwareVersion": "3.5.1",
-                "firmwareBranchOverride": "",
-            })}
-        )
-        manager = MagicMock()
+    def test_sync_persists_to_disk(self, daemon):
+        cmd = _make_cmd({
+            "referenceRepoUrl": "https://example.com/repo.git",
+            "detectedFirmwareVersion": "3.5.1",
+            "firmwareBranchOverride": "",
+        })
+        manager = Mock()
         manager.sync.return_value = {
             "activeBranch": "3.5",
             "exact": True,
@@ -968,17 +857,13 @@ class TestHandleSyncPersistence:
         assert saved["status"] == "up_to_date"
         assert "lastSyncTimestamp" in saved
 
-    def test_sync_config_error_sets_error_status(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        cmd.get_object_model.return_value = SimpleNamespace(
-            plugins={"MeltingplotConfig": SimpleNamespace(data={
-                "referenceRepoUrl": "",
-                "detectedFirmwareVersion": "",
-                "firmwareBranchOverride": "",
-            })}
-        )
-        manager = MagicMock()
+    def test_sync_config_error_sets_error_status(self, daemon):
+        cmd = _make_cmd({
+            "referenceRepoUrl": "",
+            "detectedFirmwareVersion": "",
+            "firmwareBranchOverride": "",
+        })
+        manager = Mock()
         manager.sync.return_value = {"error": "No reference repository URL configured"}
 
         with patch.object(daemon, "save_settings_to_disk") as mock_save:
@@ -990,17 +875,13 @@ class TestHandleSyncPersistence:
         mock_save.assert_called_once()
         assert mock_save.call_args[0][0]["status"] == "error"
 
-    def test_sync_network_error_sets_sync_error_status(self):
-        daemon = _import_daemon()
-        cmd = MagicMock()
-        cmd.get_object_model.return_value = SimpleNamespace(
-            plugins={"MeltingplotConfig": SimpleNamespace(data={
-                "referenceRepoUrl": "https://example.com/repo.git",
-                "detectedFirmwareVersion": "3.5.1",
-                "firmwareBranchOverride": "",
-            })}
-        )
-        manager = MagicMock()
+    def test_sync_network_error_sets_sync_error_status(self, daemon):
+        cmd = _make_cmd({
+            "referenceRepoUrl": "https://example.com/repo.git",
+            "detectedFirmwareVersion": "3.5.1",
+            "firmwareBranchOverride": "",
+        })
+        manager = Mock()
         manager.sync.return_value = {
             "error": "Cannot reach the repository server (DNS lookup failed). Check your internet connection.",
             "networkError": True,
@@ -1,67 +1,23 @@
-"""Tests for daemon startup/shutdown (main()), _make_async_handler exception
+"""Tests for daemon startup/shutdown (main()), _dispatch exception
 path, build_directory_map edge cases, and register_endpoints partial failure."""
 
 import asyncio
-import importlib.util
+import functools
 import json
-import os
-import sys
-import types
 from types import SimpleNamespace
-from unittest.mock import AsyncMock, MagicMock, call, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
 
-# --- DSF module mocking (same pattern as test_daemon.py) ---
+# The fake dsf modules and the daemon loader come from conftest.py.
 
 
 @pytest.fixture(autouse=True)
-def mock_dsf_modules(monkeypatch):
-    """Mock the dsf library modules so the daemon can be imported."""
-    dsf_mod = types.ModuleType("dsf")
-    dsf_connections = types.ModuleType("dsf.connections")
-    dsf_commands = types.ModuleType("dsf.commands")
-    dsf_commands_code = types.ModuleType("dsf.commands.code")
-    dsf_http = types.ModuleType("dsf.http")
-    dsf_object_model = types.ModuleType("dsf.object_model")
-
-    dsf_connections.CommandConnection = MagicMock
-    dsf_connections.InterceptConnection = MagicMock
-    dsf_commands_code.CodeResult = MagicMock
-
-    class FakeHttpEndpointType:
-        GET = "GET"
-        POST = "POST"
-
-    class FakeHttpResponseType:
-        StatusCode = "StatusCode"
-        PlainText = "PlainText"
-        JSON = "JSON"
-        File = "File"
-        URI = "URI"
-
-    dsf_http.HttpEndpointConnection = MagicMock
-    dsf_http.HttpResponseType = FakeHttpResponseType
-    dsf_object_model.HttpEndpointType = FakeHttpEndpointType
-
-    monkeypatch.setitem(sys.modules, "dsf", dsf_mod)
-    monkeypatch.setitem(sys.modules, "dsf.connections", dsf_connections)
-    monkeypatch.setitem(sys.modules, "dsf.commands", dsf_commands)
-    monkeypatch.setitem(sys.modules, "dsf.commands.code", dsf_commands_code)
-    monkeypatch.setitem(sys.modules, "dsf.http", dsf_http)
-    monkeypatch.setitem(sys.modules, "dsf.object_model", dsf_object_model)
-
-
-def _import_daemon():
-    """Import (or reimport) the daemon module."""
-    spec = importlib.util.spec_from_file_location(
-        "daemon_mod",
-        os.path.join(os.path.dirname(__file__), "..", "dsf", "meltingplot-config-daemon.py"),
-    )
-    mod = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(mod)
-    return mod
+def isolated_data_dir(tmp_path, monkeypatch):
+    """Keep files main() writes (settings, firmware cache) out of /opt/dsf."""
+    monkeypatch.setattr("config_manager.DATA_DIR", str(tmp_path))
+    return tmp_path
 
 
 # --- main() startup tests ---
@@ -84,9 +40,9 @@ class TestMainStartup:
         )
         return SimpleNamespace(boards=[board], directories=dirs)
 
-    def test_startup_restores_persisted_settings(self):
+    def test_startup_restores_persisted_settings(self, import_daemon):
         """Persisted settings should be restored via set_plugin_data on startup."""
-        daemon = _import_daemon()
+        daemon = import_daemon()
         cmd = MagicMock()
         model = self._make_model()
         cmd.get_object_model.return_value = model
@@ -114,9 +70,9 @@ class TestMainStartup:
         assert calls.get("firmwareBranchOverride") == "custom"
         assert calls.get("activeBranch") == "3.5"
 
-    def test_startup_skips_empty_persisted_values(self):
+    def test_startup_skips_empty_persisted_values(self, import_daemon):
         """Empty string values from disk should not be restored."""
-        daemon = _import_daemon()
+        daemon = import_daemon()
         cmd = MagicMock()
         model = self._make_model()
         cmd.get_object_model.return_value = model
@@ -143,9 +99,9 @@ class TestMainStartup:
         assert "referenceRepoUrl" in calls
         assert "firmwareBranchOverride" not in calls
 
-    def test_startup_with_no_persisted_settings(self):
+    def test_startup_with_no_persisted_settings(self, import_daemon):
         """When no settings file exists, startup continues normally."""
-        daemon = _import_daemon()
+        daemon = import_daemon()
         cmd = MagicMock()
         model = self._make_model()
         cmd.get_object_model.return_value = model
@@ -168,8 +124,8 @@ class TestMainStartup:
                 # Should NOT have been called for any persisted key
                 assert False, f"set_plugin_data called for {c[0][1]} with no persisted data"
 
-    def test_startup_detects_firmware_and_resolves_paths(self):
-        daemon = _import_daemon()
+    def test_startup_detects_firmware_and_resolves_paths(self, import_daemon):
+        daemon = import_daemon()
         cmd = MagicMock()
         model = self._make_model()
         cmd.get_object_model.return_value = model
@@ -195,9 +151,9 @@ class TestMainStartup:
         assert call_kwargs["resolved_dirs"] is not None
         assert len(call_kwargs["resolved_dirs"]) > 0
 
-    def test_startup_when_get_object_model_fails(self):
+    def test_startup_when_get_object_model_fails(self, import_daemon):
         """If get_object_model() raises, main should still start with defaults."""
-        daemon = _import_daemon()
+        daemon = import_daemon()
         cmd = MagicMock()
         cmd.get_object_model.side_effect = Exception("DSF not ready")
         cmd.resolve_path.side_effect = lambda p: f"/opt/dsf/sd/{p.split(':/', 1)[1]}"
@@ -217,9 +173,9 @@ class TestMainStartup:
         # dir_map should be None (fallback to defaults inside ConfigManager)
         assert call_kwargs["directory_map"] is None
 
-    def test_startup_with_empty_boards(self):
+    def test_startup_with_empty_boards(self, import_daemon):
         """If boards is empty, firmware detection is skipped (no set_plugin_data)."""
-        daemon = _import_daemon()
+        daemon = import_daemon()
         cmd = MagicMock()
         model = SimpleNamespace(boards=[], directories=SimpleNamespace(
             filaments="0:/filaments", firmware="0:/firmware",
@@ -243,9 +199,9 @@ class TestMainStartup:
                      if c[0][1] == "detectedFirmwareVersion"]
         assert fw_calls == []
 
-    def test_startup_with_none_firmware_version(self):
+    def test_startup_with_none_firmware_version(self, import_daemon):
         """If board.firmware_version is None, skip setting it."""
-        daemon = _import_daemon()
+        daemon = import_daemon()
         cmd = MagicMock()
         model = SimpleNamespace(
             boards=[SimpleNamespace(firmware_version=None)],
@@ -271,9 +227,43 @@ class TestMainStartup:
                      if c[0][1] == "detectedFirmwareVersion"]
         assert fw_calls == []
 
-    def test_startup_resolve_path_partial_failure(self):
+    def test_startup_caches_detected_firmware_version(self, import_daemon, isolated_data_dir):
+        daemon = import_daemon()
+        cmd = MagicMock()
+        cmd.get_object_model.return_value = self._make_model(fw_version="3.6.0")
+        cmd.resolve_path.side_effect = lambda p: f"/opt/dsf/sd/{p.split(':/', 1)[1]}"
+
+        with (
+            patch.object(daemon, "CommandConnection", return_value=cmd),
+            patch.object(daemon, "ConfigManager"),
+            patch.object(daemon, "register_endpoints", return_value=[]),
+            patch("time.sleep", side_effect=KeyboardInterrupt),
+        ):
+            daemon.main()
+
+        assert (isolated_data_dir / "firmware-version.txt").read_text() == "3.6.0"
+
+    def test_startup_uses_cached_firmware_when_model_fails(self, import_daemon, isolated_data_dir):
+        """If the object model cannot be read, the last detected version is used."""
+        (isolated_data_dir / "firmware-version.txt").write_text("3.5.1\n")
+        daemon = import_daemon()
+        cmd = MagicMock()
+        cmd.get_object_model.side_effect = Exception("DSF not ready")
+        cmd.resolve_path.side_effect = lambda p: f"/opt/dsf/sd/{p.split(':/', 1)[1]}"
+
+        with (
+            patch.object(daemon, "CommandConnection", return_value=cmd),
+            patch.object(daemon, "ConfigManager"),
+            patch.object(daemon, "register_endpoints", return_value=[]),
+            patch("time.sleep", side_effect=KeyboardInterrupt),
+        ):
+            daemon.main()
+
+        cmd.set_plugin_data.assert_any_call("MeltingplotConfig", "detectedFirmwareVersion", "3.5.1")
+
+    def test_startup_resolve_path_partial_failure(self, import_daemon):
         """If resolve_path fails for some directories, others still resolve."""
-        daemon = _import_daemon()
+        daemon = import_daemon()
         cmd = MagicMock()
         model = self._make_model()
         cmd.get_object_model.return_value = model
@@ -306,9 +296,9 @@ class TestMainStartup:
         assert "0:/sys/" in resolved
         assert "0:/macros/" not in resolved
 
-    def test_startup_resolve_path_all_fail_uses_none(self):
+    def test_startup_resolve_path_all_fail_uses_none(self, import_daemon):
         """If all resolve_path calls fail, resolved_dirs is None (defaults)."""
-        daemon = _import_daemon()
+        daemon = import_daemon()
         cmd = MagicMock()
         model = self._make_model()
         cmd.get_object_model.return_value = model
@@ -327,9 +317,9 @@ class TestMainStartup:
         # Empty dict is falsy -> passed as None
         assert call_kwargs["resolved_dirs"] is None
 
-    def test_shutdown_closes_endpoints_and_connection(self):
+    def test_shutdown_closes_endpoints_and_connection(self, import_daemon):
         """On KeyboardInterrupt, all endpoints and connection should be closed."""
-        daemon = _import_daemon()
+        daemon = import_daemon()
         cmd = MagicMock()
         model = self._make_model()
         cmd.get_object_model.return_value = model
@@ -350,9 +340,9 @@ class TestMainStartup:
         ep2.close.assert_called_once()
         cmd.close.assert_called_once()
 
-    def test_startup_resolve_path_unwraps_response_object(self):
+    def test_startup_resolve_path_unwraps_response_object(self, import_daemon):
         """resolve_path returns a Response object — daemon must use .result."""
-        daemon = _import_daemon()
+        daemon = import_daemon()
         cmd = MagicMock()
         model = self._make_model()
         cmd.get_object_model.return_value = model
@@ -382,9 +372,9 @@ class TestMainStartup:
             assert fs_path.startswith("/opt/dsf/sd/")
             assert fs_path.endswith("/")
 
-    def test_startup_empty_dir_map_falls_back_to_defaults(self):
+    def test_startup_empty_dir_map_falls_back_to_defaults(self, import_daemon):
         """If build_directory_map returns {}, use DEFAULT_DIRECTORY_MAP for resolution."""
-        daemon = _import_daemon()
+        daemon = import_daemon()
         cmd = MagicMock()
         # Model with no valid directory attributes
         model = SimpleNamespace(
@@ -407,22 +397,29 @@ class TestMainStartup:
         assert cmd.resolve_path.call_count > 0
 
 
-# --- _make_async_handler exception path tests ---
+# --- _dispatch exception path tests ---
+
+
+def _bind_handler(daemon, cmd, manager, handler_func):
+    """Register *handler_func* under a test key and return its dispatcher."""
+    key = ("GET", "test")
+    daemon.ENDPOINTS[key] = handler_func
+    return functools.partial(daemon._dispatch, cmd, manager, key)
 
 
-class TestMakeAsyncHandlerExceptionPath:
-    """Tests for _make_async_handler wrapping handler exceptions in 500 response."""
+class TestDispatchExceptionPath:
+    """Tests for _dispatch wrapping handler exceptions in 500 response."""
 
-    def test_handler_exception_returns_500(self):
+    def test_handler_exception_returns_500(self, import_daemon):
         """If handler_func raises, the wrapper should send a 500 response."""
-        daemon = _import_daemon()
+        daemon = import_daemon()
         cmd = MagicMock()
         manager = MagicMock()
 
         def failing_handler(cmd, manager, body, queries):
             raise RuntimeError("unexpected error in handler")
 
-        handler = daemon._make_async_handler(cmd, manager, failing_handler)
+        handler = _bind_handler(daemon, cmd, manager, failing_handler)
 
         # Create a mock http_conn with async methods
         http_conn = MagicMock()
@@ -439,16 +436,16 @@ class TestMakeAsyncHandlerExceptionPath:
         body = json.loads(args[1])
         assert body["error"] == "Internal server error"
 
-    def test_handler_success_sends_json_response(self):
+    def test_handler_success_sends_json_response(self, import_daemon):
         """Normal handler execution sends proper JSON response."""
-        daemon = _import_daemon()
+        daemon = import_daemon()
         cmd = MagicMock()
         manager = MagicMock()
 
         def ok_handler(cmd, manager, body, queries):
             return {"status": 200, "body": '{"ok":true}', "contentType": "application/json"}
 
-        handler = daemon._make_async_handler(cmd, manager, ok_handler)
+        handler = _bind_handler(daemon, cmd, manager, ok_handler)
 
         http_conn = MagicMock()
         request = SimpleNamespace(queries={"key": "val"}, body='{"data":1}')
@@ -461,9 +458,9 @@ class TestMakeAsyncHandlerExceptionPath:
         args = http_conn.send_response.call_args[0]
         assert args[0] == 200
 
-    def test_handler_with_file_response_type(self):
+    def test_handler_with_file_response_type(self, import_daemon):
         """Handler returning responseType='file' should use File response type."""
-        daemon = _import_daemon()
+        daemon = import_daemon()
         cmd = MagicMock()
         manager = MagicMock()
 
@@ -475,7 +472,7 @@ class TestMakeAsyncHandlerExceptionPath:
                 "responseType": "file",
             }
 
-        handler = daemon._make_async_handler(cmd, manager, file_handler)
+        handler = _bind_handler(daemon, cmd, manager, file_handler)
 
         http_conn = MagicMock()
         request = SimpleNamespace(queries={}, body="")
@@ -489,9 +486,9 @@ class TestMakeAsyncHandlerExceptionPath:
         # Third arg should be the File response type
         assert args[2] == daemon.HttpResponseType.File
 
-    def test_handler_with_none_queries_and_body(self):
+    def test_handler_with_none_queries_and_body(self, import_daemon):
         """Handler should handle None queries and body gracefully."""
-        daemon = _import_daemon()
+        daemon = import_daemon()
         cmd = MagicMock()
         manager = MagicMock()
 
@@ -502,7 +499,7 @@ class TestMakeAsyncHandlerExceptionPath:
             received["queries"] = queries
             return {"status": 200, "body": '{}', "contentType": "application/json"}
 
-        handler = daemon._make_async_handler(cmd, manager, capturing_handler)
+        handler = _bind_handler(daemon, cmd, manager, capturing_handler)
 
         http_conn = MagicMock()
         # Simulate request with None attributes
@@ -516,15 +513,42 @@ class TestMakeAsyncHandlerExceptionPath:
         assert received["queries"] == {}
 
 
+    def test_registered_handler_dispatches_by_endpoint_key(self, import_daemon):
+        """register_endpoints binds each endpoint to its ENDPOINTS entry."""
+        daemon = import_daemon()
+        cmd = MagicMock()
+        manager = MagicMock()
+        manager.get_backups.return_value = [{"hash": "abc"}]
+        handlers = {}
+
+        def add_endpoint(http_type, namespace, path):
+            ep = MagicMock()
+            ep.set_endpoint_handler.side_effect = lambda h: handlers.__setitem__(path, h)
+            return ep
+
+        cmd.add_http_endpoint.side_effect = add_endpoint
+        daemon.register_endpoints(cmd, manager)
+
+        http_conn = MagicMock()
+        http_conn.read_request = AsyncMock(return_value=SimpleNamespace(queries={}, body=""))
+        http_conn.send_response = AsyncMock()
+
+        asyncio.get_event_loop().run_until_complete(handlers["backups"](http_conn))
+
+        args = http_conn.send_response.call_args[0]
+        assert args[0] == 200
+        assert json.loads(args[1]) == {"backups": [{"hash": "abc"}]}
+
+
 # --- build_directory_map edge cases ---
 
 
 class TestBuildDirectoryMapEdgeCases:
     """Additional edge case tests for build_directory_map."""
 
-    def test_path_without_volume_prefix(self):
+    def test_path_without_volume_prefix(self, import_daemon):
         """Handles paths that lack the :/ separator (unusual but possible)."""
-        daemon = _import_daemon()
+        daemon = import_daemon()
         dirs = SimpleNamespace(
             filaments=None, firmware=None, g_codes=None,
             macros=None, menu=None, system="/sys", web=None,
@@ -534,9 +558,9 @@ class TestBuildDirectoryMapEdgeCases:
         # Without :/ separator, the whole path is used as ref_folder
         assert "/sys/" in result
 
-    def test_empty_string_values_skipped(self):
+    def test_empty_string_values_skipped(self, import_daemon):
         """Empty string directory values are skipped."""
-        daemon = _import_daemon()
+        daemon = import_daemon()
         dirs = SimpleNamespace(
             filaments="", firmware="", g_codes="",
             macros="0:/macros", menu="", system="", web="",
@@ -546,9 +570,9 @@ class TestBuildDirectoryMapEdgeCases:
         assert len(result) == 1
         assert "macros/" in result
 
-    def test_non_string_values_skipped(self):
+    def test_non_string_values_skipped(self, import_daemon):
         """Non-string directory values (e.g. int, list) are skipped."""
-        daemon = _import_daemon()
+        daemon = import_daemon()
         dirs = SimpleNamespace(
             filaments=123, firmware=None, g_codes=["path"],
             macros="0:/macros", menu=False, system="0:/sys", web=0,
@@ -559,9 +583,9 @@ class TestBuildDirectoryMapEdgeCases:
         assert "macros/" in result
         assert "sys/" in result
 
-    def test_missing_individual_attrs(self):
+    def test_missing_individual_attrs(self, import_daemon):
         """Directories object with only some known attrs."""
-        daemon = _import_daemon()
+        daemon = import_daemon()
         # Only has 'system' — all other _DIR_ATTRS fall back to getattr default
         dirs = SimpleNamespace(system="0:/sys")
         model = SimpleNamespace(directories=dirs)
@@ -575,8 +599,8 @@ class TestBuildDirectoryMapEdgeCases:
 class TestRegisterEndpointsPartialFailure:
     """Tests for register_endpoints when some endpoints fail to register."""
 
-    def test_some_endpoints_fail_others_succeed(self):
-        daemon = _import_daemon()
+    def test_some_endpoints_fail_others_succeed(self, import_daemon):
+        daemon = import_daemon()
         cmd = MagicMock()
         manager = MagicMock()
 
@@ -598,8 +622,8 @@ class TestRegisterEndpointsPartialFailure:
         total_endpoints = len(daemon.ENDPOINTS)
         assert len(registered) == total_endpoints - 1
 
-    def test_all_endpoints_succeed(self):
-        daemon = _import_daemon()
+    def test_all_endpoints_succeed(self, import_daemon):
+        daemon = import_daemon()
         cmd = MagicMock()
         manager = MagicMock()
         ep = MagicMock()
@@ -7,12 +7,9 @@ Only the DSF CommandConnection is mocked (it isn't available outside the SBC).
 Everything else is real: git repos, temp filesystems, diff engine, hunk apply.
 """
 
-import importlib.util
 import json
 import os
 import subprocess
-import sys
-import types
 from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
 
@@ -21,58 +18,6 @@ import pytest
 from config_manager import ConfigManager
 
 
-# ---------------------------------------------------------------------------
-# DSF module mocks (required because dsf-python isn't installed in test env)
-# ---------------------------------------------------------------------------
-
-@pytest.fixture(autouse=True)
-def mock_dsf_modules(monkeypatch):
-    """Mock the dsf library modules so the daemon can be imported."""
-    dsf_mod = types.ModuleType("dsf")
-    dsf_connections = types.ModuleType("dsf.connections")
-    dsf_commands = types.ModuleType("dsf.commands")
-    dsf_commands_code = types.ModuleType("dsf.commands.code")
-    dsf_http = types.ModuleType("dsf.http")
-    dsf_object_model = types.ModuleType("dsf.object_model")
-
-    dsf_connections.CommandConnection = MagicMock
-    dsf_connections.InterceptConnection = MagicMock
-    dsf_commands_code.CodeResult = MagicMock
-
-    class FakeHttpEndpointType:
-        GET = "GET"
-        POST = "POST"
-
-    class FakeHttpResponseType:
-        StatusCode = "StatusCode"
-        PlainText = "PlainText"
-        JSON = "JSON"
-        File = "File"
-        URI = "URI"
-
-    dsf_http.HttpEndpointConnection = MagicMock
-    dsf_http.HttpResponseType = FakeHttpResponseType
-    dsf_object_model.HttpEndpointType = FakeHttpEndpointType
-
-    monkeypatch.setitem(sys.modules, "dsf", dsf_mod)
-    monkeypatch.setitem(sys.modules, "dsf.connections", dsf_connections)
-    monkeypatch.setitem(sys.modules, "dsf.commands", dsf_commands)
-    monkeypatch.setitem(sys.modules, "dsf.commands.code", dsf_commands_code)
-    monkeypatch.setitem(sys.modules, "dsf.http", dsf_http)
-    monkeypatch.setitem(sys.modules, "dsf.object_model", dsf_object_model)
-
-
-def _import_daemon():
-    """Import (or reimport) the daemon module."""
-    spec = importlib.util.spec_from_file_location(
-        "daemon_mod",
-        os.path.join(os.path.dirname(__file__), "..", "dsf", "meltingplot-config-daemon.py"),
-    )
-    mod = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(mod)
-    return mod
-
-
 # ---------------------------------------------------------------------------
 # Fixtures — real git repos and temp filesystem
 # ---------------------------------------------------------------------------
@@ -148,7 +93,7 @@ def printer_fs(tmp_path):
 
 
 @pytest.fixture
-def e2e_env(tmp_path, reference_repo, printer_fs):
+def e2e_env(tmp_path, reference_repo, printer_fs, daemon):
     """Wire daemon handlers to a real ConfigManager with real git + filesystem."""
     ref_dir = str(tmp_path / "reference")
     backup_dir = str(tmp_path / "backups")
@@ -177,8 +122,6 @@ def e2e_env(tmp_path, reference_repo, printer_fs):
         plugin_data[key] = value
     cmd.set_plugin_data.side_effect = _set_plugin_data
 
-    daemon = _import_daemon()
-
     with (
         patch("config_manager.REFERENCE_DIR", ref_dir),
         patch("config_manager.BACKUP_DIR", backup_dir),
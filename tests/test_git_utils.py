@@ -2,7 +2,6 @@
 
 import os
 import subprocess
-import tempfile
 
 import pytest
 
@@ -154,6 +153,18 @@ class TestBackupRepo:
         result = git_utils.backup_commit(backup_repo, "no-op")
         assert result is None
 
+    @pytest.mark.parametrize("paths", [None, ["sys"]], ids=["all", "paths"])
+    def test_commit_skips_temp_write_files(self, backup_repo, paths):
+        sys_dir = os.path.join(backup_repo, "sys")
+        os.makedirs(sys_dir, exist_ok=True)
+        with open(os.path.join(sys_dir, "config.g"), "w") as f:
+            f.write("G28\n")
+        with open(os.path.join(sys_dir, git_utils.TEMP_FILE_PREFIX + "abc123"), "w") as f:
+            f.write("half-written")
+        commit_hash = git_utils.backup_commit(backup_repo, "snapshot", paths=paths)
+        files = git_utils.backup_files_at(backup_repo, commit_hash)
+        assert files == ["sys/config.g"]
+
     def test_files_at_commit(self, backup_repo):
         sys_dir = os.path.join(backup_repo, "sys")
         os.makedirs(sys_dir, exist_ok=True)
@@ -172,6 +183,49 @@ class TestBackupRepo:
         content = git_utils.backup_file_content(backup_repo, commit_hash, "sys/config.g")
         assert content == "G28\nM584 X0"
 
+    def test_file_contents_batch(self, backup_repo):
+        sys_dir = os.path.join(backup_repo, "sys")
+        os.makedirs(sys_dir, exist_ok=True)
+        with open(os.path.join(sys_dir, "config.g"), "w") as f:
+            f.write("G28\n")
+        first = git_utils.backup_commit(backup_repo, "first")
+        with open(os.path.join(sys_dir, "config.g"), "w") as f:
+            f.write("G28\nM584 X0\n")
+        with open(os.path.join(sys_dir, "new file.g"), "w") as f:
+            f.write("M80\n")
+        second = git_utils.backup_commit(backup_repo, "second")
+
+        contents = git_utils.backup_file_contents(backup_repo, [
+            (second, "sys/config.g"),
+            (f"{second}^", "sys/config.g"),
+            (second, "sys/new file.g"),
+            (first, "sys/new file.g"),
+            (f"{first}^", "sys/config.g"),
+            (second, "sys"),
+        ])
+        assert contents == ["G28\nM584 X0", "G28", "M80", None, None, None]
+
+    def test_file_contents_batch_matches_single(self, backup_repo):
+        sys_dir = os.path.join(backup_repo, "sys")
+        os.makedirs(sys_dir, exist_ok=True)
+        with open(os.path.join(sys_dir, "config.g"), "w") as f:
+            f.write("; header\n\nG28\n\n")
+        commit_hash = git_utils.backup_commit(backup_repo, "snapshot")
+        single = git_utils.backup_file_content(backup_repo, commit_hash, "sys/config.g")
+        batch = git_utils.backup_file_contents(backup_repo, [(commit_hash, "sys/config.g")])
+        assert batch == [single]
+
+    def test_file_contents_batch_translates_crlf(self, backup_repo):
+        sys_dir = os.path.join(backup_repo, "sys")
+        os.makedirs(sys_dir, exist_ok=True)
+        with open(os.path.join(sys_dir, "config.g"), "wb") as f:
+            f.write(b"G28\r\nM584\r\n")
+        commit_hash = git_utils.backup_commit(backup_repo, "snapshot")
+        single = git_utils.backup_file_content(backup_repo, commit_hash, "sys/config.g")
+        batch = git_utils.backup_file_contents(backup_repo, [(commit_hash, "sys/config.g")])
+        assert single == "G28\nM584"
+        assert batch == [single]
+
     def test_archive(self, backup_repo):
         sys_dir = os.path.join(backup_repo, "sys")
         os.makedirs(sys_dir, exist_ok=True)
@@ -3,7 +3,6 @@
 Uses real git repos (temp directories) and a real temp filesystem to exercise
 the complete flow across ConfigManager and git_utils."""
 
-import os
 import subprocess
 from unittest.mock import MagicMock, patch
 